@@ -0,0 +1,241 @@
+"""
+Stage-level latency benchmark with regression thresholds
+
+Times every stage of the analysis path separately -- decode, preprocess,
+forward, postprocess, enhancement and end-to-end analysis -- at several input
+resolutions and batch sizes, and reports p50/p95/p99 and the process peak
+RSS. Inputs are the sample images in assets/ and healthy/ plus a fixed subset
+of PlantVillageY1500/test, re-encoded at each upload resolution and decoded
+the way the app does (INGEST_SHORT_SIDE). Runs CPU-only and offline.
+
+    python benchmark.py --save-baseline benchmarks/baseline.json
+    python benchmark.py --baseline benchmarks/baseline.json --max-regression 15
+
+With --baseline, exits non-zero when any stage's p50 or p95 is more than
+--max-regression percent slower than the stored baseline.
+"""
+import os
+
+# CPU-only and offline: must be set before torch / ultralytics are imported
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+os.environ.setdefault("YOLO_OFFLINE", "1")
+
+import argparse
+import io
+import json
+import platform
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+import plantcare
+
+SAMPLE_DIR = Path(__file__).resolve().parent / "Image Segmentation_Plant Disease"
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        # Windows has no resource module
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / 1024 ** 2
+        except (ImportError, AttributeError):
+            return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes on Linux
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def sample_paths(test_dir, per_class):
+    """
+    assets/, healthy/ and the first per_class images of every test class, in a fixed order
+    """
+    paths = []
+    for folder in ("assets", "healthy"):
+        folder_path = SAMPLE_DIR / folder
+        if folder_path.is_dir():
+            paths.extend(sorted(str(p) for p in folder_path.iterdir() if p.suffix.lower() in (".jpg", ".jpeg", ".png")))
+    by_class = {}
+    for path, label in plantcare.list_labelled_images(test_dir):
+        by_class.setdefault(label, [])
+        if len(by_class[label]) < per_class:
+            by_class[label].append(path)
+    for label in sorted(by_class):
+        paths.extend(by_class[label])
+    return paths
+
+
+def encode_at(path, short_side):
+    """
+    JPEG bytes of the image resized so its short side is short_side
+    """
+    with Image.open(path) as image:
+        image = image.convert("RGB")
+        ratio = short_side / min(image.size)
+        image = image.resize((round(image.width * ratio), round(image.height * ratio)), Image.BICUBIC)
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=90)
+        return buffer.getvalue()
+
+
+def time_calls(fn, inputs, repeats):
+    samples = []
+    for _ in range(repeats):
+        for item in inputs:
+            start = time.perf_counter()
+            fn(item)
+            samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def summarize(samples, per_items=1):
+    samples = np.asarray(samples) / per_items
+    return {
+        "count": int(len(samples)),
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "p99_ms": float(np.percentile(samples, 99)),
+        "mean_ms": float(samples.mean()),
+    }
+
+
+def run_benchmarks(args):
+    config = plantcare.load_config()
+    # Measure real work, not cache hits, and keep stages on this thread
+    config["CACHE_ENABLED"] = False
+    config["MICRO_BATCHING"] = False
+    config["PIPELINE_ENABLED"] = False
+
+    if args.threads:
+        import torch
+        torch.set_num_threads(args.threads)
+
+    paths = sample_paths(Path(config["DATASET_PATH"]) / "test", args.per_class)
+    if not paths:
+        raise SystemExit("No benchmark images found")
+    imgsz = config["YOLO_IMGSZ"]
+    results = {}
+
+    load_start = time.perf_counter()
+    model, device = plantcare.load_yolo_model()
+    results["model_load"] = summarize([(time.perf_counter() - load_start) * 1000])
+    # Warm up so one-time graph setup is not counted
+    for _ in range(3):
+        plantcare.predict_probs(model, device, np.zeros((1, 3, imgsz, imgsz), dtype=np.float32))
+
+    # Stages are keyed by upload short side; decode reduces it to INGEST_SHORT_SIDE like the app
+    for short_side in args.resolutions:
+        encoded = [encode_at(path, short_side) for path in paths]
+        decoded = [plantcare.decode_image(data) for data in encoded]
+        results[f"decode@{short_side}"] = summarize(time_calls(plantcare.decode_image, encoded, args.repeats))
+        results[f"preprocess@{short_side}"] = summarize(
+            time_calls(lambda image: plantcare.preprocess_image(image, imgsz), decoded, args.repeats))
+
+    batch_input = np.stack([plantcare.preprocess_image(Image.open(path), imgsz) for path in paths])
+    for batch_size in args.batch_sizes:
+        batches = [batch_input[i:i + batch_size] for i in range(0, len(batch_input) - batch_size + 1, batch_size)]
+        if not batches:
+            batches = [np.resize(batch_input, (batch_size,) + batch_input.shape[1:])]
+        samples = time_calls(lambda batch: plantcare.predict_probs(model, device, batch), batches, args.repeats)
+        results[f"forward@b{batch_size}"] = summarize(samples)
+        results[f"forward_per_image@b{batch_size}"] = summarize(samples, per_items=batch_size)
+
+    probs = plantcare.predict_probs(model, device, batch_input)
+    results["postprocess"] = summarize(time_calls(plantcare.summarize_probs, probs, args.repeats))
+
+    originals = [plantcare.decode_image(encode_at(path, args.resolutions[0])) for path in paths[:args.enhance_images]]
+    if not args.skip_enhancement:
+        try:
+            plantcare.enhance_image(originals[0])
+            results["enhancement"] = summarize(time_calls(plantcare.enhance_image, originals, 1))
+        except Exception as e:
+            print(f"Skipping enhancement stage: {e}")
+
+    # The sample images are confident, so the adaptive gate would mostly skip enhancement;
+    # end_to_end_enhanced forces it and end_to_end_enhanced_gated measures the configured gate
+    adaptive = config["ADAPTIVE_ENHANCEMENT"]
+    variants = (("end_to_end", False, adaptive), ("end_to_end_enhanced", True, False),
+                ("end_to_end_enhanced_gated", True, True))
+    for label, use_enhancement, gated in variants:
+        if use_enhancement and "enhancement" not in results:
+            continue
+        config["ADAPTIVE_ENHANCEMENT"] = gated
+        results[label] = summarize(
+            time_calls(lambda image: plantcare.analyze_plant(image, use_enhancement), originals, args.repeats))
+    config["ADAPTIVE_ENHANCEMENT"] = adaptive
+
+    return results
+
+
+def compare(results, baseline, max_regression, min_delta_ms):
+    regressions = []
+    for stage, current in results.items():
+        previous = baseline["stages"].get(stage)
+        if previous is None or stage == "model_load":
+            continue
+        for metric in ("p50_ms", "p95_ms"):
+            limit = previous[metric] * (1 + max_regression / 100)
+            # Sub-millisecond stages jitter by more than any sensible percentage
+            if current[metric] > limit and current[metric] - previous[metric] > min_delta_ms:
+                change = (current[metric] / previous[metric] - 1) * 100
+                regressions.append(f"{stage} {metric}: {previous[metric]:.2f} -> {current[metric]:.2f} ms (+{change:.0f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stage-level latency benchmark for PlantCare AI")
+    parser.add_argument("--resolutions", type=int, nargs="+", default=[256, 1024, 3000], help="upload short sides")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--per-class", type=int, default=4, help="test images per class")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--enhance-images", type=int, default=3)
+    parser.add_argument("--skip-enhancement", action="store_true")
+    parser.add_argument("--threads", type=int, help="torch intra-op threads, for comparable runs")
+    parser.add_argument("--output", default="benchmarks/latest.json")
+    parser.add_argument("--baseline", help="baseline JSON to compare against")
+    parser.add_argument("--save-baseline", help="also write the results as a new baseline")
+    parser.add_argument("--max-regression", type=float, default=20.0, help="allowed slowdown in percent")
+    parser.add_argument("--min-delta-ms", type=float, default=0.5, help="ignore slowdowns smaller than this")
+    args = parser.parse_args()
+
+    stages = run_benchmarks(args)
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "python": platform.python_version(),
+        "config": {"backend": plantcare.load_config()["YOLO_BACKEND"], "threads": args.threads,
+                   "ingest_short_side": plantcare.load_config()["INGEST_SHORT_SIDE"]},
+        # ru_maxrss is a process-lifetime peak, so it is only meaningful for the whole run
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": stages,
+    }
+
+    print(f"{'stage':<28}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, stats in stages.items():
+        print(f"{stage:<28}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+    if report["peak_rss_mb"] is not None:
+        print(f"Peak RSS: {report['peak_rss_mb']:.0f} MB")
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        Path(path).write_text(json.dumps(report, indent=2))
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        regressions = compare(stages, baseline, args.max_regression, args.min_delta_ms)
+        if regressions:
+            print(f"\n✗ {len(regressions)} regression(s) above {args.max_regression}%:")
+            for line in regressions:
+                print("  " + line)
+            raise SystemExit(1)
+        print(f"\n✓ No stage regressed by more than {args.max_regression}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+Offline bulk classifier for folders of plant images
+
+Walks a directory tree, decodes images on worker threads with prefetching,
+classifies them in batches with the same model and label map as the app,
+and streams results to JSONL or Parquet. Progress is checkpointed after
+every flush so an interrupted run continues where it stopped with --resume.
+
+    python bulk_classify.py survey_photos/ --output results.parquet
+    python bulk_classify.py survey_photos/ --output results.jsonl --resume
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import plantcare
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def find_images(root):
+    """
+    All image paths under root in a stable order, so resumed runs line up
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(dirpath, name)
+
+
+def load_and_preprocess(path, imgsz):
+    """
+    Decode like the app (EXIF orientation, reduced-scale JPEG decode) so both give the same answer
+    """
+    try:
+        with open(path, "rb") as f:
+            image = plantcare.decode_image(f.read())
+        return path, plantcare.preprocess_image(image, imgsz), None
+    except Exception as e:
+        return path, None, str(e)
+
+
+def prefetch(paths, imgsz, workers, depth):
+    """
+    Decode images on a thread pool, keeping at most depth decodes in flight
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for path in paths:
+            pending.append(pool.submit(load_and_preprocess, path, imgsz))
+            if len(pending) >= depth:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class JsonlWriter:
+    def __init__(self, path, resume_bytes):
+        mode = 'r+b' if resume_bytes is not None and os.path.exists(path) else 'wb'
+        self.file = open(path, mode)
+        if mode == 'r+b':
+            # Drop anything written after the last checkpoint
+            self.file.truncate(resume_bytes)
+            self.file.seek(resume_bytes)
+
+    def write(self, rows):
+        for row in rows:
+            self.file.write((json.dumps(row) + "\n").encode("utf-8"))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def position(self):
+        return {"output_bytes": self.file.tell()}
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    """
+    Writes each flush as a complete Parquet part file in a dataset directory,
+    so every checkpoint only refers to files that are fully written
+    """
+    def __init__(self, path, resume_parts, include_probs):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa, self.pq = pa, pq
+        self.path = path
+        # One explicit schema for every part; inferring it would type the columns
+        # of an all-error part as null, and the parts could not be read together
+        fields = [
+            ("path", pa.string()),
+            ("class", pa.string()),
+            ("confidence", pa.float64()),
+            ("top5_classes", pa.list_(pa.string())),
+            ("top5_confidences", pa.list_(pa.float64())),
+            ("model_version", pa.string()),
+            ("error", pa.string()),
+        ]
+        if include_probs:
+            fields.append(("probs", pa.list_(pa.float32())))
+        self.schema = pa.schema(fields)
+        os.makedirs(path, exist_ok=True)
+        self.parts = resume_parts or 0
+        # Remove part files that were never recorded in a checkpoint
+        for name in os.listdir(path):
+            if name.startswith("part-") and int(name[5:10]) >= self.parts:
+                os.unlink(os.path.join(path, name))
+
+    def write(self, rows):
+        table = self.pa.Table.from_pylist(rows, schema=self.schema)
+        self.pq.write_table(table, os.path.join(self.path, f"part-{self.parts:05d}.parquet"))
+        self.parts += 1
+
+    def position(self):
+        return {"parts": self.parts}
+
+    def close(self):
+        pass
+
+
+def load_checkpoint(checkpoint_path, done_path):
+    if not os.path.exists(checkpoint_path):
+        return None, set()
+    with open(checkpoint_path) as f:
+        checkpoint = json.load(f)
+    done = set()
+    with open(done_path, encoding="utf-8") as f:
+        for _, line in zip(range(checkpoint["count"]), f):
+            done.add(line.rstrip("\n"))
+    return checkpoint, done
+
+
+def save_checkpoint(checkpoint_path, checkpoint):
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def make_row(path, result, model_version, include_probs):
+    row = {
+        "path": path,
+        "class": result["class"],
+        "confidence": result["confidence"],
+        "top5_classes": [name for name, _ in result["top5"]],
+        "top5_confidences": [conf for _, conf in result["top5"]],
+        "model_version": model_version,
+        "error": None,
+    }
+    if include_probs:
+        row["probs"] = [float(p) for p in result["probs"]]
+    return row
+
+
+def error_row(path, error, include_probs):
+    row = {"path": path, "class": None, "confidence": None,
+           "top5_classes": None, "top5_confidences": None, "model_version": None, "error": error}
+    if include_probs:
+        row["probs"] = None
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify every image under a folder")
+    parser.add_argument("input_dir")
+    parser.add_argument("--output", required=True, help="results.jsonl or results.parquet (a dataset directory)")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], help="defaults to the output extension")
+    parser.add_argument("--batch-size", type=int, default=plantcare.load_config()["YOLO_BATCH_SIZE"])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="decode threads")
+    parser.add_argument("--prefetch", type=int, default=256, help="images decoded ahead of the model")
+    parser.add_argument("--row-group-size", type=int, default=4096, help="rows per flush / Parquet part file")
+    parser.add_argument("--probs", action="store_true", help="also store the full probability vector")
+    parser.add_argument("--resume", action="store_true", help="continue from the last checkpoint")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    output_format = args.format or ("parquet" if args.output.endswith(".parquet") else "jsonl")
+    checkpoint_path = args.output + ".checkpoint.json"
+    done_path = args.output + ".done.txt"
+
+    checkpoint, done = load_checkpoint(checkpoint_path, done_path) if args.resume else (None, set())
+    if checkpoint is None:
+        checkpoint = {"count": 0, "output_bytes": 0, "parts": 0}
+        open(done_path, "w").close()
+    else:
+        logging.info("Resuming after %d images", checkpoint["count"])
+    # Drop done-list entries written after the checkpoint
+    with open(done_path, "r+b") as f:
+        for _ in range(checkpoint["count"]):
+            f.readline()
+        f.truncate(f.tell())
+
+    if output_format == "parquet":
+        writer = ParquetWriter(args.output, checkpoint["parts"], args.probs)
+    else:
+        writer = JsonlWriter(args.output, checkpoint["output_bytes"] if args.resume else None)
+
+    # Keep this run on one version even if the served model is hot-reloaded meanwhile
+    version = plantcare.load_model_manager().current
+    model, device = version.model, version.device
+    logging.info("Classifying with %s", version.name)
+    imgsz = plantcare.load_config()["YOLO_IMGSZ"]
+    paths = (path for path in find_images(args.input_dir) if path not in done)
+
+    rows, flushed_paths = [], []
+    batch_paths, batch_arrays = [], []
+    count, started = checkpoint["count"], time.perf_counter()
+
+    def run_batch():
+        probs = plantcare.predict_probs(model, device, np.stack(batch_arrays))
+        for path, p in zip(batch_paths, probs):
+            rows.append(make_row(path, plantcare.summarize_probs(p), version.name, args.probs))
+            flushed_paths.append(path)
+        batch_paths.clear()
+        batch_arrays.clear()
+
+    def flush():
+        nonlocal count
+        if not rows:
+            return
+        writer.write(rows)
+        count += len(rows)
+        with open(done_path, "a", encoding="utf-8") as f:
+            f.writelines(path + "\n" for path in flushed_paths)
+        save_checkpoint(checkpoint_path, dict(checkpoint, count=count, **writer.position()))
+        rows.clear()
+        flushed_paths.clear()
+        rate = (count - checkpoint["count"]) / (time.perf_counter() - started)
+        logging.info("%d images classified (%.1f img/s)", count, rate)
+
+    try:
+        for path, array, error in prefetch(paths, imgsz, args.workers, args.prefetch):
+            if error is not None:
+                rows.append(error_row(path, error, args.probs))
+                flushed_paths.append(path)
+            else:
+                batch_paths.append(path)
+                batch_arrays.append(array)
+                if len(batch_arrays) >= args.batch_size:
+                    run_batch()
+            if len(rows) >= args.row_group_size:
+                flush()
+        if batch_arrays:
+            run_batch()
+        flush()
+    finally:
+        writer.close()
+
+    logging.info("Done: %d images, results in %s", count, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Threshold sweep for the confidence cascade on PlantVillageY1500/test
+
+Scores the test split once with every cascade stage -- the cheap first stage
+(CASCADE_TINY_WEIGHTS or the served model at CASCADE_TINY_IMGSZ), the served
+model, and optionally enhancement followed by re-classification -- and
+measures each stage's cost per image. Every combination of
+CASCADE_TINY_CONFIDENCE and ENHANCE_SKIP_CONFIDENCE is then replayed offline,
+and the cheapest one whose accuracy stays within --max-accuracy-drop of
+today's pipeline (served model, plus enhancement at the configured
+threshold with --with-enhancement) is recommended.
+
+    python cascade_sweep.py
+    python cascade_sweep.py --with-enhancement --max-accuracy-drop 0.2
+
+The replay applies only the confidence thresholds. The image-quality part of
+the adaptive gate is not simulated, so the enhancement cost is an upper bound.
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+import plantcare
+from evaluate import predict_dataset
+
+THRESHOLDS = [0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.93, 0.95, 0.97, 0.98, 0.99, 0.995, 1.01]
+
+
+def enhanced_probs(model, device, items, imgsz, batch_size):
+    """
+    Probabilities of the served model on enhanced test images, and seconds per image
+    """
+    probs, batch = [], []
+    started = time.perf_counter()
+    for index, (path, _) in enumerate(items):
+        with Image.open(path) as image:
+            batch.append(plantcare.preprocess_image(plantcare.enhance_image(image.convert('RGB')), imgsz))
+        if len(batch) == batch_size or index == len(items) - 1:
+            probs.append(plantcare.predict_probs(model, device, np.stack(batch)))
+            batch = []
+    return np.concatenate(probs), (time.perf_counter() - started) / len(items)
+
+
+def replay(stages, labels, costs, tiny_threshold, enhance_threshold):
+    """
+    Accuracy, mean cost and escalation rates of one threshold pair
+    A tiny_threshold above 1 disables the first stage, like today's pipeline
+    """
+    tiny, full, enhanced = stages["tiny"], stages["full"], stages.get("enhanced")
+    to_full = tiny.max(axis=1) < tiny_threshold if tiny_threshold <= 1 else np.ones(len(labels), dtype=bool)
+    if enhanced is not None:
+        # Enhancement only follows the full model, so first-stage answers the gate
+        # would enhance are re-scored by the full model first (needs_full_model)
+        to_full |= tiny.max(axis=1) < enhance_threshold
+    predicted = np.where(to_full, full.argmax(axis=1), tiny.argmax(axis=1))
+    confidence = np.where(to_full, full.max(axis=1), tiny.max(axis=1))
+    cost = (costs["tiny"] if tiny_threshold <= 1 else 0) + to_full.mean() * costs["full"]
+
+    to_enhance = np.zeros(len(labels), dtype=bool)
+    if enhanced is not None:
+        # Every row below the threshold has a full-model answer by now; the enhanced
+        # image is always re-scored by the full model, as in analyze_plant
+        to_enhance = confidence < enhance_threshold
+        better = enhanced.max(axis=1) > confidence
+        predicted = np.where(to_enhance & better, enhanced.argmax(axis=1), predicted)
+        cost += to_enhance.mean() * costs["enhanced"]
+
+    return {
+        "tiny_confidence": tiny_threshold,
+        "enhance_skip_confidence": enhance_threshold,
+        "top1": float((predicted == labels).mean()),
+        "cost_ms": float(cost * 1000),
+        "tiny_escalation_rate": float(to_full.mean()) if tiny_threshold <= 1 else None,
+        "full_escalation_rate": float((to_enhance & to_full).sum() / max(to_full.sum(), 1)),
+    }
+
+
+def main():
+    config = plantcare.load_config()
+    parser = argparse.ArgumentParser(description="Pick cascade thresholds from a sweep on the test split")
+    parser.add_argument("--data", default=str(Path(config["DATASET_PATH"]) / "test"))
+    parser.add_argument("--weights", default=plantcare.resolve_model_path(), help="the full (served) model")
+    parser.add_argument("--tiny-weights", default=config["CASCADE_TINY_WEIGHTS"],
+                        help="first stage; defaults to --weights at --tiny-imgsz")
+    parser.add_argument("--tiny-imgsz", type=int, default=config["CASCADE_TINY_IMGSZ"])
+    parser.add_argument("--with-enhancement", action="store_true", help="also score enhanced images (slow)")
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.0, help="percentage points")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--output", default="eval/cascade_sweep.json")
+    args = parser.parse_args()
+
+    items = plantcare.list_labelled_images(args.data)
+    if not items:
+        raise SystemExit(f"No labelled images found under {args.data}")
+    imgsz = config["YOLO_IMGSZ"]
+    backend = config["YOLO_BACKEND"]
+
+    model, device = plantcare.load_classifier(args.weights, backend)
+    full, labels, full_timings = predict_dataset(model, device, items, imgsz, args.batch_size, args.workers)
+    if args.tiny_weights:
+        tiny_model, tiny_device = plantcare.load_classifier(args.tiny_weights, backend)
+    else:
+        tiny_model, tiny_device = model, device
+    tiny, _, tiny_timings = predict_dataset(tiny_model, tiny_device, items, args.tiny_imgsz,
+                                            args.batch_size, args.workers)
+    stages = {"tiny": tiny, "full": full}
+    costs = {"tiny": tiny_timings["forward"] / len(items), "full": full_timings["forward"] / len(items)}
+    if args.with_enhancement:
+        stages["enhanced"], costs["enhanced"] = enhanced_probs(model, device, items, imgsz, args.batch_size)
+
+    enhance_grid = THRESHOLDS if args.with_enhancement else [config["ENHANCE_SKIP_CONFIDENCE"]]
+    baseline = replay(stages, labels, costs, 1.01, config["ENHANCE_SKIP_CONFIDENCE"])
+    sweep = [replay(stages, labels, costs, tiny_threshold, enhance_threshold)
+             for tiny_threshold in THRESHOLDS for enhance_threshold in enhance_grid]
+    floor = baseline["top1"] - args.max_accuracy_drop / 100
+    qualifying = [row for row in sweep if row["top1"] >= floor - 1e-9]
+    best = min(qualifying, key=lambda row: (row["cost_ms"], -row["top1"]))
+
+    report = {
+        "data": args.data,
+        "images": len(items),
+        "weights": str(args.weights),
+        "tiny_weights": args.tiny_weights,
+        "tiny_imgsz": args.tiny_imgsz,
+        "stage_cost_ms": {stage: seconds * 1000 for stage, seconds in costs.items()},
+        "baseline": baseline,
+        "recommended": best,
+        "sweep": sweep,
+    }
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    Path(args.output).write_text(json.dumps(report, indent=2))
+
+    print(f"Baseline (served model{' + enhancement' if args.with_enhancement else ''}): "
+          f"top-1 {baseline['top1']*100:.2f}%, {baseline['cost_ms']:.2f} ms/image")
+    print(f"Cascade: top-1 {best['top1']*100:.2f}%, {best['cost_ms']:.2f} ms/image "
+          f"({(1 - best['cost_ms'] / baseline['cost_ms'])*100:.0f}% cheaper), "
+          f"{(1 if best['tiny_escalation_rate'] is None else best['tiny_escalation_rate'])*100:.1f}% "
+          f"escalated past the first stage")
+    if best["tiny_confidence"] > 1:
+        print("✗ No first-stage threshold holds accuracy; leave CASCADE_ENABLED off")
+    else:
+        print(f"✓ Set CASCADE_ENABLED = True and CASCADE_TINY_CONFIDENCE = {best['tiny_confidence']}")
+    if args.with_enhancement:
+        print(f"✓ Set ENHANCE_SKIP_CONFIDENCE = {best['enhance_skip_confidence']}")
+    print(f"Sweep written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""
+Knowledge distillation of the served classifier into a faster CPU student
+
+The teacher (the served best.pt by default) scores PlantVillageY1500/train
+once. Its raw logits are cached on disk as a memory-mapped .npy keyed
+by the teacher hash, imgsz and file list, so later epochs and later runs
+never execute the teacher again. The student -- the same YOLO11-cls network
+at a lower input size, initialised from the teacher, or any model yaml
+trained from scratch -- is trained on those soft targets mixed with the
+hard labels:
+
+    loss = alpha * T^2 * KL(teacher_T || student_T) + (1 - alpha) * CE(student, label)
+
+Like the original training runs, the test split doubles as the validation
+set (data.yaml val: test). The output is an ultralytics-style run under
+plant_disease_cls/ (weights/best.pt, args.yaml, results.csv), which the
+model registry indexes like any other run, plus distill_report.json
+comparing the teacher's and student's accuracy and CPU latency.
+
+    python distill.py --student-imgsz 128
+    python distill.py --student-cfg yolo11-cls.yaml --init scratch --epochs 100
+"""
+import argparse
+import copy
+import csv
+import json
+import logging
+import time
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+from PIL import Image
+
+import plantcare
+from evaluate import compute_metrics, predict_dataset
+from model_registry import measure_cpu_latency
+
+
+def teacher_logits(teacher, device, batch):
+    """
+    Pre-softmax outputs of a torch classifier for an N x 3 x H x W batch
+    Log-probabilities of clipped softmax would pin the confident teacher's
+    wrong classes to the same floor and lose the ranking T > 1 relies on
+    """
+    import torch
+    tensor = torch.from_numpy(np.ascontiguousarray(batch)).to(device)
+    with torch.inference_mode():
+        output = teacher.model(tensor)
+    # The Classify head returns (probs, logits) in eval mode
+    if not isinstance(output, (list, tuple)):
+        raise Exception("The installed ultralytics does not return classifier logits; upgrade it to distil")
+    return output[1].float().cpu().numpy()
+
+
+def cache_teacher_logits(teacher, device, items, imgsz, teacher_sha, cache_dir, batch_size):
+    """
+    Teacher logits for items as a read-only memory map, computed once
+    The cache is reused while the teacher hash, imgsz and file list are unchanged
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    stem = f"teacher_logits_{teacher_sha[:12]}_{imgsz}px"
+    logits_path, meta_path = cache_dir / f"{stem}.npy", cache_dir / f"{stem}.json"
+    paths = [path for path, _ in items]
+    if logits_path.exists() and meta_path.exists():
+        if json.loads(meta_path.read_text()).get("paths") == paths:
+            logging.info("Reusing cached teacher logits %s", logits_path)
+            return np.load(logits_path, mmap_mode="r")
+
+    logging.info("Caching teacher logits for %d images in %s", len(items), logits_path)
+    logits = np.lib.format.open_memmap(f"{logits_path}.tmp", mode="w+", dtype=np.float32,
+                                       shape=(len(items), len(plantcare.CLASS_NAMES)))
+    for start in range(0, len(items), batch_size):
+        batch = [path for path, _ in items[start:start + batch_size]]
+        arrays = []
+        for path in batch:
+            with Image.open(path) as image:
+                arrays.append(plantcare.preprocess_image(image, imgsz))
+        logits[start:start + len(batch)] = teacher_logits(teacher, device, np.stack(arrays))
+    logits.flush()
+    del logits
+    Path(f"{logits_path}.tmp").replace(logits_path)
+    meta_path.write_text(json.dumps({"teacher_sha256": teacher_sha, "imgsz": imgsz, "paths": paths}))
+    return np.load(logits_path, mmap_mode="r")
+
+
+class DistillationDataset:
+    """
+    (student input, index) pairs; the index selects the cached soft target and label
+    """
+    def __init__(self, items, imgsz, augment):
+        self.items = items
+        self.imgsz = imgsz
+        self.augment = augment
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        path, _ = self.items[index]
+        with Image.open(path) as image:
+            array = plantcare.preprocess_image(image, self.imgsz)
+        # Flips keep the label and the teacher's view of the leaf the same
+        if self.augment and np.random.random() < 0.5:
+            array = np.ascontiguousarray(array[:, :, ::-1])
+        return array, index
+
+
+def seed_worker(worker_id):
+    """
+    Give every DataLoader worker its own reproducible NumPy seed for the flips
+    """
+    import torch
+    np.random.seed(torch.initial_seed() % 2 ** 32)
+
+
+def build_student(teacher_model, cfg, init):
+    from ultralytics.nn.tasks import ClassificationModel
+
+    if init == "teacher":
+        student = copy.deepcopy(teacher_model.model)
+    else:
+        student = ClassificationModel(cfg, nc=len(plantcare.CLASS_NAMES))
+    student.names = dict(enumerate(plantcare.CLASS_NAMES))
+    for parameter in student.parameters():
+        parameter.requires_grad_(True)
+    return student.float()
+
+
+def distillation_loss(student_logits, teacher_logits, labels, temperature, alpha):
+    import torch.nn.functional as F
+
+    soft = F.kl_div(F.log_softmax(student_logits / temperature, dim=1),
+                    F.log_softmax(teacher_logits / temperature, dim=1),
+                    reduction="batchmean", log_target=True) * temperature ** 2
+    hard = F.cross_entropy(student_logits, labels)
+    return alpha * soft + (1 - alpha) * hard
+
+
+def save_checkpoint(path, student, epoch, fitness, train_args):
+    """
+    Save in the layout ultralytics writes, so YOLO(path) and load_classifier can load it
+    """
+    import torch
+
+    torch.save({
+        "epoch": epoch,
+        "best_fitness": fitness,
+        "model": copy.deepcopy(student).half(),
+        "ema": None,
+        "optimizer": None,
+        "train_args": train_args,
+        "date": datetime.now().isoformat(),
+    }, path)
+
+
+def main():
+    config = plantcare.load_config()
+    dataset = Path(config["DATASET_PATH"])
+    parser = argparse.ArgumentParser(description="Distil the served classifier into a faster student")
+    parser.add_argument("--teacher", default=plantcare.resolve_model_path())
+    parser.add_argument("--train-dir", default=str(dataset / "train"))
+    parser.add_argument("--val-dir", default=str(dataset / "test"))
+    parser.add_argument("--teacher-imgsz", type=int, default=config["YOLO_IMGSZ"])
+    parser.add_argument("--student-imgsz", type=int, default=128)
+    parser.add_argument("--student-cfg", default="yolo11-cls.yaml", help="model yaml for --init scratch")
+    parser.add_argument("--init", choices=["teacher", "scratch"], default="teacher")
+    parser.add_argument("--epochs", type=int, default=30)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--lr", type=float, help="defaults to 1e-4 from the teacher, 1e-3 from scratch")
+    parser.add_argument("--temperature", type=float, default=4.0)
+    parser.add_argument("--alpha", type=float, default=0.7, help="weight of the soft-target loss")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cache-dir", default=str(Path(config["CACHE_DIR"]) / "distillation"))
+    parser.add_argument("--project", default=config["MODEL_RUNS_PATH"])
+    parser.add_argument("--name", help="defaults to distilled_<imgsz>px")
+    args = parser.parse_args()
+
+    import torch
+    from torch.utils.data import DataLoader
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+    run_dir = Path(args.project) / (args.name or f"distilled_{args.student_imgsz}px")
+    (run_dir / "weights").mkdir(parents=True, exist_ok=True)
+
+    teacher, device = plantcare.load_classifier(args.teacher, "torch")
+    teacher_sha = plantcare.file_sha256(args.teacher)
+    train_items = plantcare.list_labelled_images(args.train_dir)
+    val_items = plantcare.list_labelled_images(args.val_dir)
+    if not train_items or not val_items:
+        raise SystemExit("No labelled images found in the train or validation split")
+    teacher_logits = cache_teacher_logits(teacher, device, train_items, args.teacher_imgsz, teacher_sha,
+                                          args.cache_dir, args.batch_size)
+    labels = np.array([label for _, label in train_items])
+
+    student = build_student(teacher, args.student_cfg, args.init).to(device)
+    lr = args.lr or (1e-4 if args.init == "teacher" else 1e-3)
+    optimizer = torch.optim.AdamW(student.parameters(), lr=lr, weight_decay=5e-4)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=args.epochs)
+    loader = DataLoader(DistillationDataset(train_items, args.student_imgsz, augment=True),
+                        batch_size=args.batch_size, shuffle=True, num_workers=args.workers,
+                        generator=torch.Generator().manual_seed(args.seed), worker_init_fn=seed_worker)
+
+    train_args = {"task": "classify", "model": args.student_cfg if args.init == "scratch" else str(args.teacher),
+                  "teacher": str(args.teacher), "data": str(Path(args.train_dir).parent),
+                  "epochs": args.epochs, "batch": args.batch_size, "imgsz": args.student_imgsz,
+                  "lr0": lr, "temperature": args.temperature, "alpha": args.alpha,
+                  "seed": args.seed, "name": run_dir.name}
+    import yaml
+    (run_dir / "args.yaml").write_text(yaml.safe_dump(train_args, sort_keys=False))
+
+    results_file = open(run_dir / "results.csv", "w", newline="")
+    results = csv.writer(results_file)
+    results.writerow(["epoch", "time", "train/loss", "metrics/accuracy_top1", "metrics/accuracy_top5", "lr/pg0"])
+    best_fitness, started = -1.0, time.perf_counter()
+    try:
+        for epoch in range(1, args.epochs + 1):
+            student.train()
+            total_loss = 0.0
+            for batch, indices in loader:
+                indices = indices.numpy()
+                student_logits = student(batch.to(device))
+                soft_targets = torch.from_numpy(np.asarray(teacher_logits[indices])).to(device)
+                hard_targets = torch.from_numpy(labels[indices]).to(device)
+                loss = distillation_loss(student_logits, soft_targets, hard_targets, args.temperature, args.alpha)
+                optimizer.zero_grad()
+                loss.backward()
+                optimizer.step()
+                total_loss += loss.item() * len(indices)
+            scheduler.step()
+
+            student.eval()
+            # predict_probs expects the ultralytics wrapper, which keeps the network in .model
+            probs, val_labels, _ = predict_dataset(SimpleNamespace(model=student), device, val_items,
+                                                   args.student_imgsz, args.batch_size, args.workers)
+            metrics = compute_metrics(probs, val_labels)
+            fitness = (metrics["top1"] + metrics["top5"]) / 2
+            results.writerow([epoch, f"{time.perf_counter() - started:.3f}", f"{total_loss / len(train_items):.5f}",
+                              f"{metrics['top1']:.5f}", f"{metrics['top5']:.5f}", f"{scheduler.get_last_lr()[0]:.6g}"])
+            results_file.flush()
+            save_checkpoint(run_dir / "weights" / "last.pt", student, epoch, fitness, train_args)
+            if fitness > best_fitness:
+                best_fitness = fitness
+                save_checkpoint(run_dir / "weights" / "best.pt", student, epoch, fitness, train_args)
+            logging.info("Epoch %d/%d loss %.4f top-1 %.4f top-5 %.4f", epoch, args.epochs,
+                         total_loss / len(train_items), metrics["top1"], metrics["top5"])
+    finally:
+        results_file.close()
+
+    # Compare the best student with its teacher on accuracy and batch-1 CPU latency
+    best_path = run_dir / "weights" / "best.pt"
+    student_model, student_device = plantcare.load_classifier(best_path, "torch")
+    report = {"teacher": {"weights": str(args.teacher), "imgsz": args.teacher_imgsz},
+              "student": {"weights": str(best_path), "imgsz": args.student_imgsz}}
+    for role, model, model_device in (("teacher", teacher, device), ("student", student_model, student_device)):
+        imgsz = report[role]["imgsz"]
+        probs, val_labels, timings = predict_dataset(model, model_device, val_items, imgsz,
+                                                     args.batch_size, args.workers)
+        metrics = compute_metrics(probs, val_labels)
+        report[role].update({
+            "top1": metrics["top1"],
+            "top5": metrics["top5"],
+            "macro_f1": metrics["macro_avg"]["f1-score"],
+            "size_mb": Path(report[role]["weights"]).stat().st_size / 1e6,
+            "cpu_latency_ms": measure_cpu_latency(report[role]["weights"], imgsz, iterations=50),
+        })
+    report["top1_delta"] = report["student"]["top1"] - report["teacher"]["top1"]
+    report["speedup"] = report["teacher"]["cpu_latency_ms"] / report["student"]["cpu_latency_ms"]
+    (run_dir / "distill_report.json").write_text(json.dumps(report, indent=2))
+
+    for role in ("teacher", "student"):
+        info = report[role]
+        print(f"{role:<8} {info['imgsz']:>4} px  top-1 {info['top1']*100:.2f}%  top-5 {info['top5']*100:.2f}%  "
+              f"{info['cpu_latency_ms']:.2f} ms CPU  {info['size_mb']:.1f} MB")
+    print(f"Student is {report['speedup']:.1f}x faster, top-1 {report['top1_delta']*100:+.2f} pp")
+    print(f"✓ Student written to {best_path}")
+    print(f"  Use it as the cascade first stage: CASCADE_TINY_WEIGHTS = r\"{best_path}\", "
+          f"CASCADE_TINY_IMGSZ = {args.student_imgsz}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Batched evaluation of a classifier checkpoint on PlantVillageY1500
+
+Replaces the per-image evaluation loops in the notebooks: the test split is
+loaded through a multi-worker DataLoader and scored in a single batched pass,
+and top-1/top-5, per-class precision/recall/F1, the confusion matrix and
+throughput are all computed from that one pass.
+
+    python evaluate.py
+    python evaluate.py --weights "plant_disease_cls/yolov11_classifier6/weights/best.pt" --workers 8
+    python evaluate.py --ensemble --exit-confidence 0.9
+
+Artifacts written to --output-dir:
+    metrics.json           accuracy, per-class report, throughput
+    confusion_matrix.csv   rows = true class, columns = predicted class
+    predictions.npz        probs, labels and paths for further analysis
+"""
+import argparse
+import csv
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+import plantcare
+
+
+class LabelledImageDataset:
+    """
+    Map-style dataset of (preprocessed image, label) for torch's DataLoader
+    """
+    def __init__(self, items, imgsz):
+        self.items = items
+        self.imgsz = imgsz
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        path, label = self.items[index]
+        with Image.open(path) as image:
+            return plantcare.preprocess_image(image, self.imgsz), label
+
+
+def predict_dataset(model, device, items, imgsz, batch_size=64, workers=4, ensemble=None):
+    """
+    Score every item in one batched pass
+    ensemble is an optional (members, primary_weight, exit_confidence) for plantcare.predict_ensemble
+    Returns (probs, labels, timings) with timings in seconds and the ensemble escalation count
+    """
+    from torch.utils.data import DataLoader
+
+    loader = DataLoader(LabelledImageDataset(items, imgsz), batch_size=batch_size,
+                        num_workers=workers, shuffle=False)
+    probs, labels = [], []
+    forward_seconds, escalated = 0.0, 0
+    started = time.perf_counter()
+    for batch, batch_labels in loader:
+        batch = batch.numpy()
+        forward_start = time.perf_counter()
+        batch_probs = plantcare.predict_probs(model, device, batch)
+        if ensemble is not None:
+            batch_probs, batch_escalated = plantcare.predict_ensemble(batch_probs, batch, *ensemble)
+            escalated += int(batch_escalated.sum())
+        probs.append(batch_probs)
+        forward_seconds += time.perf_counter() - forward_start
+        labels.append(batch_labels.numpy())
+    total_seconds = time.perf_counter() - started
+    timings = {"total": total_seconds, "forward": forward_seconds, "escalated": escalated}
+    return np.concatenate(probs), np.concatenate(labels), timings
+
+
+def compute_metrics(probs, labels):
+    from sklearn.metrics import classification_report
+
+    class_ids = list(range(len(plantcare.CLASS_NAMES)))
+    top5 = np.argsort(probs, axis=1)[:, ::-1][:, :5]
+    predicted = top5[:, 0]
+    n = len(plantcare.CLASS_NAMES)
+    confusion = np.bincount(labels * n + predicted, minlength=n * n).reshape(n, n)
+    report = classification_report(labels, predicted, labels=class_ids, target_names=plantcare.CLASS_NAMES,
+                                   output_dict=True, zero_division=0)
+    return {
+        "images": int(len(labels)),
+        "top1": float((predicted == labels).mean()),
+        "top5": float((top5 == labels[:, None]).any(axis=1).mean()),
+        "mean_confidence": float(probs.max(axis=1).mean()),
+        "per_class": {name: report[name] for name in plantcare.CLASS_NAMES},
+        "macro_avg": report["macro avg"],
+        "weighted_avg": report["weighted avg"],
+        "confusion_matrix": confusion.tolist(),
+    }
+
+
+def save_artifacts(output_dir, metrics, probs, labels, items):
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    (output_dir / "metrics.json").write_text(json.dumps(metrics, indent=2))
+    with open(output_dir / "confusion_matrix.csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["true \\ predicted"] + plantcare.CLASS_NAMES)
+        for name, row in zip(plantcare.CLASS_NAMES, metrics["confusion_matrix"]):
+            writer.writerow([name] + row)
+    np.savez_compressed(output_dir / "predictions.npz", probs=probs, labels=labels,
+                        paths=np.array([path for path, _ in items]))
+
+
+def main():
+    config = plantcare.load_config()
+    parser = argparse.ArgumentParser(description="Evaluate a classifier checkpoint on PlantVillageY1500")
+    parser.add_argument("--weights", default=plantcare.resolve_model_path())
+    parser.add_argument("--backend", default=config["YOLO_BACKEND"], choices=["torch", "onnxruntime", "onnxruntime-int8"])
+    parser.add_argument("--data", default=str(Path(config["DATASET_PATH"]) / "test"))
+    parser.add_argument("--imgsz", type=int, default=config["YOLO_IMGSZ"])
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=4, help="DataLoader decode workers")
+    parser.add_argument("--output-dir", help="defaults to eval/<checkpoint name>")
+    parser.add_argument("--ensemble", action="store_true", help="average with the ENSEMBLE_MEMBERS checkpoints")
+    parser.add_argument("--exit-confidence", type=float, default=config["ENSEMBLE_EXIT_CONFIDENCE"],
+                        help="skip the other members when the first is this confident (above 1 disables)")
+    args = parser.parse_args()
+
+    weights = Path(args.weights)
+    run_name = weights.parent.parent.name if weights.parent.name == "weights" else weights.parent.name
+    suffix = "_ensemble" if args.ensemble else ""
+    output_dir = args.output_dir or Path("eval") / f"{run_name}_{weights.stem}{suffix}".replace(" ", "_")
+
+    load_start = time.perf_counter()
+    model, device = plantcare.load_classifier(weights, args.backend)
+    load_seconds = time.perf_counter() - load_start
+
+    ensemble = None
+    if args.ensemble:
+        members = [(member, weight) for member, weight in plantcare.load_ensemble_members()
+                   if member.sha256 != plantcare.file_sha256(weights)]
+        ensemble = (members, config["ENSEMBLE_PRIMARY_WEIGHT"], args.exit_confidence)
+
+    items = plantcare.list_labelled_images(args.data)
+    if not items:
+        raise SystemExit(f"No labelled images found under {args.data}")
+    probs, labels, timings = predict_dataset(model, device, items, args.imgsz, args.batch_size, args.workers, ensemble)
+
+    metrics = compute_metrics(probs, labels)
+    metrics.update({
+        "weights": str(weights),
+        "backend": args.backend,
+        "data": args.data,
+        "imgsz": args.imgsz,
+        "batch_size": args.batch_size,
+        "ensemble": [member.name for member, _ in ensemble[0]] if ensemble else None,
+        "ensemble_escalation_rate": timings["escalated"] / len(items) if ensemble else None,
+        "load_seconds": load_seconds,
+        "eval_seconds": timings["total"],
+        "images_per_second": len(items) / timings["total"],
+        "forward_images_per_second": len(items) / timings["forward"],
+    })
+    save_artifacts(output_dir, metrics, probs, labels, items)
+
+    print(f"Top-1 {metrics['top1']*100:.2f}%  Top-5 {metrics['top5']*100:.2f}%  "
+          f"macro F1 {metrics['macro_avg']['f1-score']:.4f}")
+    print(f"{len(items)} images in {timings['total']:.2f}s ({metrics['images_per_second']:.1f} img/s, "
+          f"forward only {metrics['forward_images_per_second']:.1f} img/s)")
+    if ensemble:
+        print(f"Ensemble of {len(ensemble[0]) + 1} checkpoints, "
+              f"{metrics['ensemble_escalation_rate']*100:.1f}% of images ran past the first")
+    print(f"Artifacts written to {output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Model registry over the plant_disease_cls training runs
+
+Indexes every run (yolov11_classifier*, yolov11_classifier_clean*) into a
+small JSON catalog: final and best-epoch top-1/top-5 from results.csv, imgsz
+from args.yaml, the SHA-256 and size of weights/best.pt, and a measured
+batch-1 CPU latency. load_yolo_model serves the checkpoint the configured
+policy selects from this catalog, so best.pt no longer has to be copied into
+"Yolov11 Variants for PDP/" by hand.
+
+    python model_registry.py build
+    python model_registry.py list
+    python model_registry.py select --metric best_top1 --max-latency-ms 15
+
+Rebuilding only re-measures latency for runs whose weights changed.
+"""
+import argparse
+import platform
+import time
+
+import numpy as np
+
+import plantcare
+
+METRICS = ["best_top1", "best_top5", "final_top1", "final_top5"]
+
+
+def measure_cpu_latency(weights, imgsz, iterations, warmup=5):
+    """
+    Median batch-1 forward time in milliseconds on the CPU
+    """
+    model, device = plantcare.load_classifier(weights, "torch", device="cpu")
+    dummy = np.random.default_rng(0).random((1, 3, imgsz, imgsz), dtype=np.float32)
+    for _ in range(warmup):
+        plantcare.predict_probs(model, device, dummy)
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        plantcare.predict_probs(model, device, dummy)
+        samples.append((time.perf_counter() - start) * 1000)
+    return float(np.median(samples))
+
+
+def build(args):
+    previous = plantcare.load_model_catalog(args.catalog)
+    if args.remeasure:
+        previous = None
+    entries = plantcare.scan_model_runs(args.runs_dir, previous["models"] if previous else None)
+
+    if args.threads:
+        import torch
+        torch.set_num_threads(args.threads)
+    for entry in entries:
+        if entry["weights"] is None or args.skip_latency or entry["cpu_latency_ms"] is not None:
+            continue
+        imgsz = entry["imgsz"] or plantcare.load_config()["YOLO_IMGSZ"]
+        entry["cpu_latency_ms"] = measure_cpu_latency(entry["weights"], imgsz, args.iterations)
+        print(f"✓ {entry['run']}: {entry['cpu_latency_ms']:.2f} ms")
+
+    catalog = {
+        "runs_dir": str(args.runs_dir),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "latency": {"platform": platform.platform(), "processor": platform.processor(),
+                    "threads": args.threads, "iterations": args.iterations},
+        "models": entries,
+    }
+    plantcare.save_model_catalog(args.catalog, catalog)
+    print(f"Indexed {len(entries)} runs "
+          f"({sum(entry['weights'] is not None for entry in entries)} with weights) into {args.catalog}")
+
+
+def show(args):
+    catalog = plantcare.load_model_catalog(args.catalog)
+    if catalog is None:
+        raise SystemExit(f"No catalog at {args.catalog}; run: python model_registry.py build")
+    print(f"{'run':<28}{'epochs':>7}{'best top1':>10}{'best top5':>10}{'final top1':>11}"
+          f"{'imgsz':>7}{'MB':>7}{'CPU ms':>8}")
+    for entry in catalog["models"]:
+        size = f"{entry['size_mb']:.1f}" if entry["size_mb"] else "-"
+        latency = f"{entry['cpu_latency_ms']:.2f}" if entry["cpu_latency_ms"] is not None else "-"
+        print(f"{entry['run']:<28}{entry.get('epochs', 0):>7}{entry.get('best_top1', 0):>10.4f}"
+              f"{entry.get('best_top5', 0):>10.4f}{entry.get('final_top1', 0):>11.4f}"
+              f"{entry['imgsz'] or '-':>7}{size:>7}{latency:>8}")
+
+
+def select(args):
+    catalog = plantcare.load_model_catalog(args.catalog)
+    if catalog is None:
+        raise SystemExit(f"No catalog at {args.catalog}; run: python model_registry.py build")
+    entry = plantcare.select_model(catalog["models"], args.metric, args.max_latency_ms, args.run, args.imgsz)
+    if entry is None:
+        print("✗ No registered checkpoint satisfies the policy")
+        raise SystemExit(1)
+    print(f"✓ {entry['run']}: {args.metric} {entry[args.metric]:.4f}, "
+          f"{entry['cpu_latency_ms'] or 0:.2f} ms CPU, sha256 {entry['weights_sha256'][:12]}")
+    print(entry["weights"])
+
+
+def main():
+    config = plantcare.load_config()
+    parser = argparse.ArgumentParser(description="Index training runs and select a checkpoint to serve")
+    parser.add_argument("--catalog", default=config["MODEL_REGISTRY_PATH"])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = commands.add_parser("build", help="scan the runs and measure CPU latency")
+    build_parser.add_argument("--runs-dir", default=config["MODEL_RUNS_PATH"])
+    build_parser.add_argument("--iterations", type=int, default=50)
+    build_parser.add_argument("--threads", type=int, help="torch intra-op threads for the latency runs")
+    build_parser.add_argument("--skip-latency", action="store_true", help="index accuracy and weights only")
+    build_parser.add_argument("--remeasure", action="store_true", help="measure latency for every run again")
+    build_parser.set_defaults(handler=build)
+
+    list_parser = commands.add_parser("list", help="print the catalog")
+    list_parser.set_defaults(handler=show)
+
+    select_parser = commands.add_parser("select", help="print the checkpoint a policy picks")
+    select_parser.add_argument("--metric", default=config["MODEL_SELECTION_METRIC"], choices=METRICS)
+    select_parser.add_argument("--max-latency-ms", type=float, default=config["MODEL_MAX_LATENCY_MS"])
+    select_parser.add_argument("--run", default=config["MODEL_PIN_RUN"], help="only consider this run")
+    select_parser.add_argument("--imgsz", type=int, default=config["YOLO_IMGSZ"],
+                               help="only consider runs trained at this input size")
+    select_parser.set_defaults(handler=select)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
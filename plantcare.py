@@ -0,0 +1,2228 @@
+"""
+Shared inference code for PlantCare AI
+
+Configuration, model loading and hot reload, Real-ESRGAN enhancement, the
+result cache, classification, micro-batching and the analysis pipeline.
+real.py renders the Streamlit page on top of this module; server.py and the
+command-line tools import it directly, without Streamlit.
+"""
+from PIL import Image, ImageOps
+from pathlib import Path
+import numpy as np
+import warnings
+import sys
+import logging
+import os
+import io
+import json
+import importlib
+import subprocess
+import shutil
+import tempfile
+import time
+import uuid
+import hashlib
+import functools
+import contextlib
+import threading
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import OrderedDict, Counter
+
+# ==============================
+# SHARED RESOURCES
+# ==============================
+def cache_resource(fn):
+    """
+    Build a shared resource (config, models, pools) once per process and argument tuple
+    Thread-safe like st.cache_resource, which it replaces so this module does
+    not need Streamlit; a call that raises is not cached
+    """
+    lock = threading.RLock()
+    results = {}
+    
+    @functools.wraps(fn)
+    def wrapper(*args):
+        with lock:
+            if args not in results:
+                results[args] = fn(*args)
+            return results[args]
+    
+    wrapper.clear = results.clear
+    return wrapper
+
+# ==============================
+# CONFIGURATION
+# ==============================
+@cache_resource
+def load_config():
+    config = {
+        "REALESRGAN_PATH": r"C:\Users\vkr30\Real-ESRGAN",
+        "MODEL_REALESRGAN_PATH": r"C:\Users\vkr30\Real-ESRGAN\weights\RealESRGAN_x4plus.pth",
+        # Fallback when the model registry has no catalog or no checkpoint fits the policy
+        "YOLO_MODEL_PATH": r"C:\Users\vkr30\Image Segmentation_Plant Disease\Yolov11 Variants for PDP\best.pt",
+        "HEALTHY_IMAGES_PATH": r"C:\Users\vkr30\Image Segmentation_Plant Disease\healthy",
+        "DATASET_PATH": r"C:\Users\vkr30\Image Segmentation_Plant Disease\PlantVillageY1500",
+        # Training runs indexed by model_registry.py into MODEL_REGISTRY_PATH
+        "MODEL_RUNS_PATH": r"C:\Users\vkr30\Image Segmentation_Plant Disease\plant_disease_cls",
+        "MODEL_REGISTRY_PATH": str(Path(__file__).resolve().parent / "model_registry.json"),
+        # Serve the registered checkpoint with the best value of this metric
+        # (best_top1, best_top5, final_top1, final_top5) within the CPU latency budget
+        "MODEL_SELECTION_METRIC": "best_top1",
+        "MODEL_MAX_LATENCY_MS": 15,
+        # Run name to serve regardless of the metric, e.g. "yolov11_classifier6"
+        "MODEL_PIN_RUN": None,
+        # Run Real-ESRGAN inside this process instead of launching inference_realesrgan.py
+        "REALESRGAN_INPROCESS": True,
+        # Peak memory the in-process enhancer may use before switching to tiles
+        "REALESRGAN_PEAK_MEMORY_MB": 2048,
+        "REALESRGAN_TILE_OVERLAP": 16,
+        # Larger 4x outputs are streamed down to this size instead of being built in memory
+        "REALESRGAN_MAX_OUTPUT_MEGAPIXELS": 16,
+        # "classify" super-resolves only up to the classifier input size, "full" upscales the whole image 4x
+        "ENHANCEMENT_MODE": "classify",
+        # Input size the YOLO classifier was trained at (imgsz in plant_disease_cls/*/args.yaml)
+        "YOLO_IMGSZ": 224,
+        "YOLO_BATCH_SIZE": 32,
+        # Adaptive gate: only enhance low-confidence predictions on images enhancement can help
+        "ADAPTIVE_ENHANCEMENT": True,
+        "ENHANCE_SKIP_CONFIDENCE": 0.90,
+        "ENHANCE_BLUR_THRESHOLD": 100.0,
+        "ENHANCE_BLOCKINESS_THRESHOLD": 1.4,
+        # Content-addressed cache for predictions (memory) and enhanced images (disk)
+        "CACHE_ENABLED": True,
+        "CACHE_DIR": str(Path(__file__).resolve().parent / "cache"),
+        "CACHE_MAX_PREDICTIONS": 10000,
+        "CACHE_MAX_DISK_MB": 2048,
+        # Per-request scratch folders for the subprocess enhancer, deleted after each call
+        "REALESRGAN_SCRATCH_DIR": os.path.join(tempfile.gettempdir(), "plantcare_realesrgan"),
+        # Set above 0 to keep finished scratch folders for debugging, capped by age and size
+        "REALESRGAN_DEBUG_RETENTION_SECONDS": 0,
+        "REALESRGAN_DEBUG_MAX_MB": 512,
+        # Shared scheduler that batches classification requests from concurrent sessions
+        "MICRO_BATCHING": True,
+        "MICRO_BATCH_MAX_SIZE": 16,
+        "MICRO_BATCH_MAX_WAIT_MS": 10,
+        # "torch" runs best.pt through ultralytics, "onnxruntime" exports it once to best.onnx,
+        # "onnxruntime-int8" loads the best.int8.onnx produced by quantize.py
+        "YOLO_BACKEND": "torch",
+        # 0 lets ONNX Runtime pick the number of threads
+        "ONNX_INTRA_OP_THREADS": 0,
+        # Dummy inferences run on a newly loaded model before it serves requests
+        "WARMUP_ITERATIONS": 3,
+        # Swap in new weights without a restart when the served weights file
+        # changes or a rebuilt registry catalog selects another checkpoint
+        "MODEL_HOT_RELOAD": True,
+        "MODEL_WATCH_INTERVAL_SECONDS": 5,
+        # Staged execution: decode, enhancement and classification each get their own worker pool
+        "PIPELINE_ENABLED": True,
+        "PIPELINE_DECODE_WORKERS": 2,
+        "PIPELINE_ENHANCE_WORKERS": 1,
+        "PIPELINE_CLASSIFY_WORKERS": 4,
+        "PIPELINE_MAX_IN_FLIGHT": 32,
+        # Test-time augmentation for uncertain predictions, a cheaper fallback than Real-ESRGAN
+        "TTA_ENABLED": False,
+        "TTA_CONFIDENCE_THRESHOLD": 0.70,
+        # Average the served model with more checkpoints over the same preprocessed batch.
+        # Members must share YOLO_IMGSZ; images the served model already scores at or
+        # above ENSEMBLE_EXIT_CONFIDENCE skip the other members, so serve the cheapest one
+        "ENSEMBLE_ENABLED": False,
+        "ENSEMBLE_PRIMARY_WEIGHT": 1.0,
+        "ENSEMBLE_MEMBERS": [
+            {"weights": r"C:\Users\vkr30\Image Segmentation_Plant Disease\Yolov11 Variants for PDP\best8.pt", "weight": 1.0},
+            {"weights": r"C:\Users\vkr30\Image Segmentation_Plant Disease\plant_disease_cls\yolov11_classifier4\weights\best.pt", "weight": 1.0},
+        ],
+        "ENSEMBLE_EXIT_CONFIDENCE": 0.95,
+        # Cascade: a cheap first stage answers confident images, the rest go on to the
+        # served model and then, below ENHANCE_SKIP_CONFIDENCE, to enhancement.
+        # CASCADE_TINY_WEIGHTS None runs the served checkpoint at CASCADE_TINY_IMGSZ;
+        # pick the thresholds with cascade_sweep.py
+        "CASCADE_ENABLED": False,
+        "CASCADE_TINY_WEIGHTS": None,
+        "CASCADE_TINY_IMGSZ": 128,
+        "CASCADE_TINY_CONFIDENCE": 0.97,
+        # Uploads are decoded and stored at this short side, enough for display and the classifier
+        "INGEST_SHORT_SIDE": 1024,
+        # Prometheus /metrics on 127.0.0.1 for the Streamlit process, 0 disables it
+        "METRICS_PORT": 9464,
+        # Per-stage latency and counters in an expander under the results
+        "METRICS_DEBUG_PANEL": False
+    }
+    return config
+
+# ==============================
+# DISEASE CURES
+# ==============================
+DISEASE_CURE = {
+    "Pepper__bell___Bacterial_spot": [
+        "Remove and destroy infected leaves.",
+        "Spray copper-based bactericides regularly.",
+        "Practice crop rotation and sanitize tools to prevent spread.",
+        "Ensure good air circulation by pruning dense foliage."
+    ],
+    "Potato___Early_blight": [
+        "Remove affected foliage to prevent spore spread.",
+        "Apply fungicides containing Chlorothalonil or Mancozeb.",
+        "Rotate crops and avoid planting potatoes in the same soil consecutively.",
+        "Ensure proper spacing for good air circulation."
+    ],
+    "Potato___Late_blight": [
+        "Remove and destroy infected plants immediately.",
+        "Apply fungicides containing Metalaxyl or Mancozeb at the first signs of infection.",
+        "Avoid overhead irrigation; use drip irrigation instead.",
+        "Plant resistant potato varieties if available."
+    ],
+    "Tomato_Bacterial_spot": [
+        "Remove and destroy infected leaves.",
+        "Spray copper-based bactericides regularly.",
+        "Practice crop rotation and sanitize tools to prevent spread.",
+        "Ensure good air circulation by pruning dense foliage."
+    ],
+    "Tomato_Early_blight": [
+        "Remove affected leaves and destroy them.",
+        "Apply fungicides such as Chlorothalonil or Copper hydroxide.",
+        "Rotate crops and avoid planting tomatoes in the same soil consecutively.",
+        "Keep soil moisture consistent but avoid wetting leaves."
+    ],
+    "Tomato_Late_blight": [
+        "Remove infected plants and dispose of them safely.",
+        "Apply protective fungicides like Metalaxyl or Mancozeb before infection spreads.",
+        "Ensure good drainage to prevent waterlogging.",
+        "Plant resistant tomato varieties if possible."
+    ],
+    "Tomato_Leaf_Mold": [
+        "Remove infected leaves to prevent spore spread.",
+        "Apply fungicides such as Mancozeb or Copper oxychloride.",
+        "Maintain proper plant spacing for airflow.",
+        "Avoid wetting leaves during irrigation."
+    ],
+    "Tomato_Septoria_leaf_spot": [
+        "Remove infected leaves and destroy them.",
+        "Apply fungicides like Chlorothalonil or Mancozeb.",
+        "Practice crop rotation and keep soil clean from debris.",
+        "Ensure proper spacing and airflow around plants."
+    ],
+    "Tomato_Spider_mites_Two_spotted_spider_mite": [
+        "Spray insecticidal soap or neem oil directly on affected areas.",
+        "Maintain adequate humidity to discourage mite development.",
+        "Introduce natural predators like ladybugs or predatory mites.",
+        "Avoid excessive use of nitrogen fertilizers which favor mite growth."
+    ],
+    "Tomato__Target_Spot": [
+        "Remove and destroy infected leaves.",
+        "Apply fungicides like Chlorothalonil or Copper oxychloride.",
+        "Ensure good spacing and pruning for airflow.",
+        "Practice crop rotation to reduce recurring infections."
+    ],
+    "Tomato__Tomato_YellowLeaf__Curl_Virus": [
+        "Remove and destroy infected plants immediately.",
+        "Control whitefly populations using yellow sticky traps or insecticides.",
+        "Avoid planting tomatoes near infected crops.",
+        "Use resistant tomato varieties if available."
+    ],
+    "Tomato__Tomato_mosaic_virus": [
+        "Remove infected plants and sanitize all tools.",
+        "Avoid handling healthy plants after touching infected ones.",
+        "Practice crop rotation and avoid planting tomatoes continuously.",
+        "Wash hands and tools frequently to prevent virus spread."
+    ]
+}
+
+# ==============================
+# CLASS LABELS
+# ==============================
+# Index order of the classifier output (PlantVillageY1500/data.yaml)
+CLASS_NAMES = [
+    "Pepper__bell___Bacterial_spot","Pepper__bell___healthy",
+    "Potato___Early_blight","Potato___Late_blight","Potato___healthy",
+    "Tomato_Bacterial_spot","Tomato_Early_blight","Tomato_Late_blight",
+    "Tomato_Leaf_Mold","Tomato_Septoria_leaf_spot",
+    "Tomato_Spider_mites_Two_spotted_spider_mite","Tomato__Target_Spot",
+    "Tomato__Tomato_YellowLeaf__Curl_Virus","Tomato__Tomato_mosaic_virus",
+    "Tomato_healthy"
+]
+
+def list_labelled_images(split_dir):
+    """
+    (path, class index) pairs for a PlantVillageY1500 split laid out as <split>/<class name>/<image>
+    """
+    items = []
+    for class_idx, name in enumerate(CLASS_NAMES):
+        class_dir = Path(split_dir) / name
+        if class_dir.is_dir():
+            items.extend((str(path), class_idx) for path in sorted(class_dir.iterdir())
+                         if path.suffix.lower() in ('.jpg', '.jpeg', '.png'))
+    return items
+
+# ==============================
+# SUPPRESS WARNINGS
+# ==============================
+warnings.filterwarnings('ignore')
+logging.getLogger("ultralytics").setLevel(logging.ERROR)
+
+# ==============================
+# INSTRUMENTATION
+# ==============================
+logger = logging.getLogger("plantcare")
+
+# Histogram bucket upper bounds; +Inf is always added
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 180.0)
+CONFIDENCE_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99)
+MEGAPIXEL_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 12.0, 16.0, 24.0, 48.0)
+
+METRIC_DEFINITIONS = {
+    "plantcare_requests_total": ("counter", "Analyses started", None),
+    "plantcare_enhancement_total": ("counter", "Enhancement outcomes per analysis (used, skipped, failed)", None),
+    "plantcare_cache_requests_total": ("counter", "Result cache lookups by cache and result", None),
+    "plantcare_stage_errors_total": ("counter", "Stage executions that raised", None),
+    "plantcare_stage_duration_seconds": ("histogram", "Wall time per pipeline stage", LATENCY_BUCKETS),
+    "plantcare_prediction_confidence": ("histogram", "Top-1 confidence of classifier results", CONFIDENCE_BUCKETS),
+    "plantcare_input_megapixels": ("histogram", "Size of decoded uploads before downscaling", MEGAPIXEL_BUCKETS),
+    "plantcare_ensemble_total": ("counter", "Images that exited on the served model or ran the full ensemble", None),
+    "plantcare_cascade_total": ("counter", "Cascade decisions per stage (accepted or escalated to the next stage)", None),
+}
+
+class _Span:
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe("plantcare_stage_duration_seconds", time.perf_counter() - self.start, stage=self.stage)
+        if exc_type is not None:
+            self.metrics.inc("plantcare_stage_errors_total", stage=self.stage)
+        return False
+
+class Metrics:
+    """
+    Thread-safe counters and fixed-bucket histograms, rendered in the
+    Prometheus text exposition format
+    """
+    def __init__(self, definitions):
+        self.definitions = definitions
+        self.lock = threading.Lock()
+        # name -> {sorted label tuple -> value}
+        self.counters = {}
+        # name -> {sorted label tuple -> [bucket counts, sum, count]}
+        self.histograms = {}
+    
+    def inc(self, name, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+    
+    def observe(self, name, value, **labels):
+        buckets = self.definitions[name][2]
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = [[0] * len(buckets), 0.0, 0]
+            entry = series[key]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+    
+    def span(self, stage):
+        """
+        Context manager that records the wall time of a stage, and an error if it raises
+        """
+        return _Span(self, stage)
+    
+    def render(self):
+        """
+        All series in Prometheus text format, cumulative buckets included
+        """
+        lines = []
+        with self.lock:
+            for name, (kind, help_text, buckets) in self.definitions.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                if kind == "counter":
+                    for key, value in sorted(self.counters.get(name, {}).items()):
+                        lines.append(f"{name}{_format_labels(key)} {value}")
+                    continue
+                for key, (counts, total, count) in sorted(self.histograms.get(name, {}).items()):
+                    cumulative = 0
+                    for bound, bucket_count in zip(buckets, counts):
+                        cumulative += bucket_count
+                        lines.append(f"{name}_bucket{_format_labels(key + (('le', repr(float(bound))),))} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(key + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {total}")
+                    lines.append(f"{name}_count{_format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+    
+    def stage_summary(self):
+        """
+        Count, mean and bucket-estimated p50/p95 per stage, for the debug panel
+        """
+        summary = {}
+        with self.lock:
+            series = self.histograms.get("plantcare_stage_duration_seconds", {})
+            for key, (counts, total, count) in sorted(series.items()):
+                stage = dict(key)["stage"]
+                summary[stage] = {
+                    "count": count,
+                    "mean_ms": total / count * 1000,
+                    "p50_ms": _bucket_quantile(LATENCY_BUCKETS, counts, count, 0.50) * 1000,
+                    "p95_ms": _bucket_quantile(LATENCY_BUCKETS, counts, count, 0.95) * 1000,
+                }
+        return summary
+    
+    def counter_values(self):
+        with self.lock:
+            return {name: {", ".join(f"{k}={v}" for k, v in key) or "total": value
+                           for key, value in sorted(series.items())}
+                    for name, series in self.counters.items()}
+
+def _format_labels(key):
+    if not key:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in key)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(key, escaped)) + "}"
+
+def _bucket_quantile(buckets, counts, count, q):
+    """
+    Upper bound of the bucket holding the q-quantile, like histogram_quantile without interpolation
+    """
+    rank = q * count
+    cumulative = 0
+    for bound, bucket_count in zip(buckets, counts):
+        cumulative += bucket_count
+        if cumulative >= rank:
+            return bound
+    return float("inf")
+
+@cache_resource
+def load_metrics():
+    return Metrics(METRIC_DEFINITIONS)
+
+def timed(stage):
+    """
+    Decorator form of Metrics.span
+    """
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with load_metrics().span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+@cache_resource
+def start_metrics_server():
+    """
+    Serve /metrics on localhost for the Streamlit process; server.py exposes its own
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    
+    port = load_config()["METRICS_PORT"]
+    if not port:
+        return None
+    
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = load_metrics().render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, format, *args):
+            pass
+    
+    try:
+        server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    except OSError as e:
+        logger.warning("Metrics endpoint disabled, port %d unavailable: %s", port, e)
+        return None
+    threading.Thread(target=server.serve_forever, name="plantcare-metrics", daemon=True).start()
+    print(f"✓ Metrics at http://127.0.0.1:{port}/metrics")
+    return server
+
+# ==============================
+# MODEL REGISTRY
+# ==============================
+def read_run_results(results_csv):
+    """
+    Final and best-epoch top-1/top-5 from an ultralytics results.csv
+    The best epoch is the one with the highest (top1 + top5) / 2, the
+    fitness ultralytics uses when it saves best.pt for classification
+    """
+    import csv
+    with open(results_csv, newline='') as f:
+        # Older ultralytics versions pad the column names with spaces
+        rows = [{key.strip(): value.strip() for key, value in row.items()} for row in csv.DictReader(f)]
+    if not rows:
+        return {}
+    top1 = np.array([float(row["metrics/accuracy_top1"]) for row in rows])
+    top5 = np.array([float(row["metrics/accuracy_top5"]) for row in rows])
+    best = int(np.argmax(top1 + top5))
+    return {
+        "epochs": len(rows),
+        "final_top1": float(top1[-1]),
+        "final_top5": float(top5[-1]),
+        "best_top1": float(top1[best]),
+        "best_top5": float(top5[best]),
+        "best_epoch": int(float(rows[best]["epoch"])),
+    }
+
+def scan_model_runs(runs_dir, previous=None):
+    """
+    Index every training run under runs_dir (one entry per run with a results.csv)
+    Latency measured for an earlier catalog is kept while the weights hash is unchanged
+    """
+    import yaml
+    
+    previous = {entry["run"]: entry for entry in (previous or [])}
+    entries = []
+    for run_dir in sorted(Path(runs_dir).iterdir()):
+        results_csv = run_dir / "results.csv"
+        if not results_csv.is_file():
+            continue
+        entry = {"run": run_dir.name, "imgsz": None, "weights": None, "weights_sha256": None,
+                 "size_mb": None, "cpu_latency_ms": None}
+        entry.update(read_run_results(results_csv))
+        
+        args_yaml = run_dir / "args.yaml"
+        if args_yaml.is_file():
+            with open(args_yaml) as f:
+                entry["imgsz"] = (yaml.safe_load(f) or {}).get("imgsz")
+        
+        weights = run_dir / "weights" / "best.pt"
+        if weights.is_file():
+            digest = file_sha256(weights)
+            entry.update(weights=str(weights), weights_sha256=digest, size_mb=weights.stat().st_size / 1e6)
+            old = previous.get(run_dir.name)
+            if old is not None and old.get("weights_sha256") == digest:
+                entry["cpu_latency_ms"] = old.get("cpu_latency_ms")
+        entries.append(entry)
+    return entries
+
+def load_model_catalog(path):
+    """
+    The catalog written by model_registry.py, or None if it has not been built
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def save_model_catalog(path, catalog):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(catalog, f, indent=1)
+    os.replace(tmp_path, path)
+
+def select_model(entries, metric="best_top1", max_latency_ms=None, run=None, imgsz=None):
+    """
+    Pick the registered checkpoint with the highest metric, optionally under a
+    CPU latency budget, trained at imgsz, or pinned to one run; ties go to the faster model
+    Returns the catalog entry, or None when nothing qualifies
+    """
+    candidates = [entry for entry in entries if entry["weights"] and os.path.exists(entry["weights"])
+                  and entry.get(metric) is not None]
+    if imgsz is not None:
+        # e.g. distilled low-resolution students, which are cascade first stages rather than the served model
+        candidates = [entry for entry in candidates if entry["imgsz"] in (None, imgsz)]
+    if run is not None:
+        candidates = [entry for entry in candidates if entry["run"] == run]
+    if max_latency_ms is not None:
+        candidates = [entry for entry in candidates
+                      if entry["cpu_latency_ms"] is not None and entry["cpu_latency_ms"] <= max_latency_ms]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda entry: (entry[metric], -(entry["cpu_latency_ms"] or float("inf"))))
+
+def select_served_weights():
+    """
+    Weights chosen from the registry by the configured policy, falling back to
+    YOLO_MODEL_PATH when no catalog exists or no checkpoint satisfies the policy
+    Reads the catalog on every call, so a rebuilt registry is picked up
+    """
+    config = load_config()
+    catalog = load_model_catalog(config["MODEL_REGISTRY_PATH"])
+    if catalog is None:
+        return config["YOLO_MODEL_PATH"]
+    entry = select_model(catalog["models"], config["MODEL_SELECTION_METRIC"],
+                         config["MODEL_MAX_LATENCY_MS"], config["MODEL_PIN_RUN"], config["YOLO_IMGSZ"])
+    if entry is None:
+        print("!!! No registered model satisfies the selection policy, using YOLO_MODEL_PATH")
+        return config["YOLO_MODEL_PATH"]
+    print(f"✓ Registry selected {entry['run']} ({config['MODEL_SELECTION_METRIC']} "
+          f"{entry[config['MODEL_SELECTION_METRIC']]:.4f}, {entry['cpu_latency_ms'] or 0:.1f} ms CPU)")
+    return entry["weights"]
+
+@cache_resource
+def resolve_model_path():
+    """
+    The registry's choice at startup; ModelManager re-selects on catalog changes
+    """
+    return select_served_weights()
+
+def is_servable_weights(path):
+    """
+    Whether path may be loaded on request: a registered checkpoint, a file
+    under MODEL_RUNS_PATH, or YOLO_MODEL_PATH. Checkpoints are pickles, so
+    arbitrary paths from a client are never loaded
+    """
+    config = load_config()
+    try:
+        path = Path(path).resolve()
+    except (OSError, RuntimeError):
+        return False
+    if not path.is_file():
+        return False
+    if path == Path(config["YOLO_MODEL_PATH"]).resolve():
+        return True
+    runs_dir = Path(config["MODEL_RUNS_PATH"]).resolve()
+    if runs_dir == path or runs_dir in path.parents:
+        return True
+    catalog = load_model_catalog(config["MODEL_REGISTRY_PATH"])
+    registered = [entry["weights"] for entry in (catalog or {}).get("models", []) if entry["weights"]]
+    return any(path == Path(weights).resolve() for weights in registered)
+
+# ==============================
+# LOAD MODELS
+# ==============================
+class OnnxClassifier:
+    """
+    YOLO classifier exported to ONNX and run with ONNX Runtime on the CPU
+    """
+    def __init__(self, path, intra_op_threads=0):
+        import onnxruntime as ort
+        
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.path = path
+        self.session = ort.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+    
+    def predict(self, batch):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        return self.session.run(None, {self.input_name: batch})[0]
+
+def read_artifact_source(artifact_path):
+    """
+    SHA-256 of the weights an exported artifact was built from, or None if unknown
+    Stored in a <artifact>.sha256 sidecar, since mtimes survive mv and copy2
+    """
+    source_path = Path(f"{artifact_path}.sha256")
+    if not source_path.exists():
+        return None
+    return source_path.read_text().strip()
+
+def write_artifact_source(artifact_path, weights_sha256):
+    Path(f"{artifact_path}.sha256").write_text(weights_sha256 + "\n")
+
+def export_onnx(weights_path, imgsz):
+    """
+    Export weights to ONNX next to the .pt file, reusing the export while it
+    was built from weights with the same hash
+    """
+    weights_path = Path(weights_path)
+    onnx_path = weights_path.with_suffix(".onnx")
+    digest = file_sha256(weights_path)
+    if onnx_path.exists() and read_artifact_source(onnx_path) == digest:
+        return onnx_path
+    
+    from ultralytics import YOLO
+    
+    print(f"Exporting {weights_path} to ONNX...")
+    exported = YOLO(str(weights_path)).export(format="onnx", imgsz=imgsz, dynamic=True)
+    if Path(exported) != onnx_path:
+        shutil.move(exported, onnx_path)
+    write_artifact_source(onnx_path, digest)
+    print(f"✓ ONNX model cached at: {onnx_path}")
+    return onnx_path
+
+def load_classifier(weights_path, backend="torch", device=None):
+    """
+    Load a classifier checkpoint with the given backend, returns (model, device)
+    Not cached; the app uses load_yolo_model, tools use this to load any checkpoint
+    """
+    config = load_config()
+    if backend == "onnxruntime-int8":
+        int8_path = Path(weights_path).with_suffix(".int8.onnx")
+        if not int8_path.exists():
+            raise FileNotFoundError(f"INT8 model not found at: {int8_path} (run quantize.py first)")
+        # Never serve an INT8 graph of another checkpoint under this one's version name
+        if read_artifact_source(int8_path) != file_sha256(weights_path):
+            raise Exception(f"INT8 model {int8_path} was not quantized from the current {weights_path} "
+                            f"(run quantize.py again)")
+        return OnnxClassifier(int8_path, config["ONNX_INTRA_OP_THREADS"]), "cpu"
+    if backend == "onnxruntime":
+        onnx_path = export_onnx(weights_path, config["YOLO_IMGSZ"])
+        return OnnxClassifier(onnx_path, config["ONNX_INTRA_OP_THREADS"]), "cpu"
+    
+    # Heavy imports happen here rather than at module import, so the UI renders first
+    import torch
+    from ultralytics import YOLO
+    
+    device = torch.device(device or ('cuda' if torch.cuda.is_available() else 'cpu'))
+    model = YOLO(str(weights_path))
+    # Build the label map once at load instead of on every prediction
+    model.model.names = dict(enumerate(CLASS_NAMES))
+    model.model.to(device).float().eval()
+    return model, device
+
+def _file_stamp(path):
+    """
+    (mtime, size) of a file, or None if it does not exist
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+class ModelVersion:
+    """
+    One loaded classifier checkpoint and the number of requests using it
+    """
+    def __init__(self, weights_path, backend):
+        weights_path = Path(weights_path)
+        self.weights = str(weights_path)
+        self.stamp = _file_stamp(weights_path)
+        self.sha256 = file_sha256(weights_path)
+        run = weights_path.parent.parent.name if weights_path.parent.name == "weights" else weights_path.parent.name
+        self.name = f"{run}/{weights_path.name}@{self.sha256[:12]}"
+        self.model, self.device = load_classifier(weights_path, backend)
+        self.loaded_at = time.time()
+        self.in_flight = 0
+        self.retired = False
+
+class ModelManager:
+    """
+    Serves one classifier version at a time and swaps in new weights without a restart
+    
+    A reload loads and warms the new checkpoint on a background thread, then
+    swaps it in under the lock. Requests hold the version they acquired, so
+    in-flight work finishes on the old model, which is released once the
+    last of those requests is done
+    """
+    def __init__(self, backend, warmup_iterations, watch_interval):
+        self.backend = backend
+        self.warmup_iterations = warmup_iterations
+        self.lock = threading.Lock()
+        self.draining = []
+        self.reloads = 0
+        self.last_error = None
+        self.catalog_stamp = _file_stamp(load_config()["MODEL_REGISTRY_PATH"])
+        self.current = self._load(resolve_model_path())
+        # The weights the watcher keeps serving: the registry's choice, or the last reloaded file
+        self.target = self.current.weights
+        self.pending, self.failed = None, None
+        print(f"✓ Serving model {self.current.name}")
+        self.reloader = ThreadPoolExecutor(1, thread_name_prefix="plantcare-reload")
+        if watch_interval:
+            self.watch_interval = watch_interval
+            threading.Thread(target=self._watch, name="plantcare-model-watch", daemon=True).start()
+    
+    def _load(self, weights_path):
+        version = ModelVersion(weights_path, self.backend)
+        imgsz = load_config()["YOLO_IMGSZ"]
+        dummy = np.zeros((1, 3, imgsz, imgsz), dtype=np.float32)
+        for _ in range(self.warmup_iterations):
+            predict_probs(version.model, version.device, dummy)
+        return version
+    
+    @contextlib.contextmanager
+    def acquire(self):
+        """
+        Pin the current version for the duration of a request
+        """
+        with self.lock:
+            version = self.current
+            version.in_flight += 1
+        try:
+            yield version
+        finally:
+            with self.lock:
+                version.in_flight -= 1
+                drained = version.retired and version.in_flight == 0
+            if drained:
+                self._release(version)
+    
+    def reload(self, weights_path=None):
+        """
+        Load weights_path (default: the registry's current choice) in the
+        background and swap it in; returns a Future of the new version name
+        """
+        return self.reloader.submit(self._reload, weights_path)
+    
+    def _reload(self, weights_path):
+        weights_path = weights_path or select_served_weights()
+        try:
+            with load_metrics().span("model_reload"):
+                version = self._load(weights_path)
+        except Exception as e:
+            self.last_error = f"{weights_path}: {e}"
+            logger.exception("Model reload from %s failed, still serving %s", weights_path, self.current.name)
+            raise
+        with self.lock:
+            old = self.current
+            self.current = version
+            old.retired = True
+            drained = old.in_flight == 0
+            if not drained:
+                self.draining.append(old)
+        self.target = version.weights
+        self.reloads += 1
+        self.last_error = None
+        print(f"✓ Swapped model {old.name} -> {version.name}")
+        if drained:
+            self._release(old)
+        return version.name
+    
+    def _release(self, version):
+        with self.lock:
+            if version in self.draining:
+                self.draining.remove(version)
+        version.model = None
+        if "torch" in sys.modules and version.device is not None and str(version.device).startswith("cuda"):
+            sys.modules["torch"].cuda.empty_cache()
+        print(f"✓ Released model {version.name}")
+    
+    def _watch(self):
+        """
+        Reload when the served weights file changes, or when a rebuilt registry
+        catalog selects a different checkpoint. A change is only acted on once
+        the file has stopped changing for one poll, so half-copied weights are
+        never loaded, and a file that failed to load is not retried until it changes again
+        """
+        while True:
+            time.sleep(self.watch_interval)
+            try:
+                self._poll()
+            except Exception as e:
+                logger.warning("Model watch failed: %s", e)
+    
+    def _poll(self):
+        """
+        One watcher step; the registry's choice is kept in self.target so a
+        catalog change is still acted on when it is debounced on a later poll
+        """
+        catalog_stamp = _file_stamp(load_config()["MODEL_REGISTRY_PATH"])
+        if catalog_stamp != self.catalog_stamp:
+            self.catalog_stamp = catalog_stamp
+            self.target = str(Path(select_served_weights()))
+        target, current = self.target, self.current
+        stamp = (target, _file_stamp(target))
+        if stamp[1] is None or (target == current.weights and stamp[1] == current.stamp):
+            self.pending = None
+            return
+        if stamp == self.failed:
+            return
+        if stamp != self.pending:
+            self.pending = stamp
+            return
+        self.pending = None
+        try:
+            self.reload(target).result()
+        except Exception:
+            self.failed = stamp
+    
+    def status(self):
+        with self.lock:
+            current, draining = self.current, list(self.draining)
+        return {
+            "version": current.name,
+            "weights": current.weights,
+            "sha256": current.sha256,
+            "loaded_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(current.loaded_at)),
+            "in_flight": current.in_flight,
+            "reloads": self.reloads,
+            "last_error": self.last_error,
+            "draining": {version.name: version.in_flight for version in draining},
+        }
+
+@cache_resource
+def load_model_manager():
+    config = load_config()
+    interval = config["MODEL_WATCH_INTERVAL_SECONDS"] if config["MODEL_HOT_RELOAD"] else 0
+    return ModelManager(config["YOLO_BACKEND"], config["WARMUP_ITERATIONS"], interval)
+
+def load_yolo_model():
+    """
+    (model, device) of the version being served right now
+    Request paths should use load_model_manager().acquire() so a hot reload
+    cannot release the model while they are still using it
+    """
+    version = load_model_manager().current
+    return version.model, version.device
+
+@cache_resource
+def load_realesrgan_model():
+    """
+    Load the RealESRGAN_x4plus RRDBNet once and keep it in memory
+    """
+    import torch
+    from basicsr.archs.rrdbnet_arch import RRDBNet
+    
+    config = load_config()
+    model_path = config["MODEL_REALESRGAN_PATH"]
+    if not os.path.exists(model_path):
+        raise Exception(f"Model weights not found at: {model_path}")
+    
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4)
+    weights = torch.load(model_path, map_location='cpu')
+    # Released checkpoints store the EMA weights under 'params_ema'
+    key = 'params_ema' if 'params_ema' in weights else 'params'
+    model.load_state_dict(weights[key], strict=True)
+    model.eval()
+    model = model.to(device)
+    return model, device
+
+# ==============================
+# BACKGROUND WARM-UP
+# ==============================
+class ModelWarmup:
+    """
+    Imports the inference stack, loads the classifier and runs a few dummy
+    inferences on a background thread, so the UI renders immediately and the
+    first real request does not pay for cold start
+    """
+    def __init__(self):
+        self.ready = threading.Event()
+        self.error = None
+        self.phases = {}
+        self.thread = threading.Thread(target=self._run, name="plantcare-warmup", daemon=True)
+        self.thread.start()
+    
+    def _phase(self, name, fn):
+        start = time.perf_counter()
+        result = fn()
+        self.phases[name] = time.perf_counter() - start
+        print(f"✓ Startup phase {name}: {self.phases[name]*1000:.0f} ms")
+        return result
+    
+    def _run(self):
+        try:
+            config = load_config()
+            if config["YOLO_BACKEND"] == "torch":
+                self._phase("import_torch", lambda: importlib.import_module("torch"))
+                self._phase("import_ultralytics", lambda: importlib.import_module("ultralytics"))
+            else:
+                self._phase("import_onnxruntime", lambda: importlib.import_module("onnxruntime"))
+            # The model manager runs the dummy inferences before it serves a version
+            self._phase("load_and_warm_model", load_model_manager)
+            if config["ENSEMBLE_ENABLED"]:
+                self._phase("load_ensemble", load_ensemble_members)
+            if config["CASCADE_ENABLED"]:
+                self._phase("load_cascade", load_cascade_model)
+            print(f"✓ Model ready after {sum(self.phases.values())*1000:.0f} ms")
+        except Exception as e:
+            self.error = e
+            print(f"!!! Model warm-up failed: {e}")
+        finally:
+            self.ready.set()
+    
+    def wait(self, timeout=None):
+        """
+        Block until warm-up has finished; re-raises a warm-up failure
+        """
+        finished = self.ready.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return finished
+    
+    def status(self):
+        return {
+            "ready": self.ready.is_set() and self.error is None,
+            "error": str(self.error) if self.error is not None else None,
+            "phases_ms": {name: seconds * 1000 for name, seconds in self.phases.items()},
+        }
+
+@cache_resource
+def start_model_warmup():
+    return ModelWarmup()
+
+# ==============================
+# IMAGE ENHANCEMENT WITH REAL-ESRGAN
+# ==============================
+_last_debug_prune = 0.0
+_debug_prune_lock = threading.Lock()
+
+def _retain_scratch_for_debug(request_dir, debug_root, retention_seconds, max_bytes):
+    """
+    Move a finished request folder into the debug area and prune it by age and size
+    The prune scans the debug area, so it runs at most once a minute
+    """
+    global _last_debug_prune
+    os.makedirs(debug_root, exist_ok=True)
+    shutil.move(request_dir, os.path.join(debug_root, os.path.basename(request_dir)))
+    
+    with _debug_prune_lock:
+        now = time.time()
+        if now - _last_debug_prune < 60:
+            return
+        _last_debug_prune = now
+    
+    entries = []
+    for entry in os.scandir(debug_root):
+        size = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+        entries.append((entry.stat().st_mtime, size, entry.path))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    for mtime, size, path in entries:
+        if now - mtime > retention_seconds or total > max_bytes:
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+def enhance_image_with_realesrgan(image):
+    """
+    Enhance image using Real-ESRGAN via subprocess call
+    Each call works in its own scratch folder that is removed afterwards
+    """
+    config = load_config()
+    
+    # Private scratch folder for this request, so the output path is known
+    # up front and no shared folder ever needs to be listed or cleaned by hand
+    scratch_root = config["REALESRGAN_SCRATCH_DIR"]
+    os.makedirs(scratch_root, exist_ok=True)
+    unique_id = uuid.uuid4().hex[:8]
+    request_dir = tempfile.mkdtemp(prefix=f"plantcare_{unique_id}_", dir=scratch_root)
+    
+    input_path = os.path.join(request_dir, f"plantcare_{unique_id}.png")
+    output_folder = os.path.join(request_dir, "results")
+    # Real-ESRGAN adds the _out suffix
+    output_path = os.path.join(output_folder, f"plantcare_{unique_id}_out.png")
+    
+    try:
+        # Verify Real-ESRGAN installation
+        inference_script = os.path.join(config["REALESRGAN_PATH"], "inference_realesrgan.py")
+        if not os.path.exists(inference_script):
+            raise Exception(f"Real-ESRGAN inference script not found at: {inference_script}")
+        
+        model_path = config["MODEL_REALESRGAN_PATH"]
+        if not os.path.exists(model_path):
+            raise Exception(f"Model weights not found at: {model_path}")
+        
+        image.save(input_path, "PNG")
+        
+        # Build Real-ESRGAN command - process single file
+        command = [
+            sys.executable,
+            inference_script,
+            "-n", "RealESRGAN_x4plus",
+            "-i", input_path,
+            "-o", output_folder,
+            "-s", "4",
+            "--fp32",
+            "--ext", "png"  # Force PNG output
+        ]
+        logger.info("Running Real-ESRGAN command: %s", " ".join(command))
+        
+        # Run Real-ESRGAN enhancement from its directory
+        with load_metrics().span("realesrgan_subprocess"):
+            result = subprocess.run(
+                command, 
+                capture_output=True, 
+                text=True,
+                timeout=180,
+                cwd=config["REALESRGAN_PATH"]
+            )
+        
+        # subprocess.run returns after the child has exited and closed the file
+        if not os.path.exists(output_path):
+            error_msg = f"""
+Real-ESRGAN did not produce output image.
+
+Paths:
+- Input: {input_path}
+- Expected output: {output_path}
+
+Real-ESRGAN output (return code {result.returncode}):
+{result.stdout}
+{result.stderr}
+
+Suggestion: Try running this command manually in terminal:
+cd {config["REALESRGAN_PATH"]}
+python inference_realesrgan.py -n RealESRGAN_x4plus -i <image> -o <output folder> -s 4 --fp32
+            """
+            raise Exception(error_msg)
+        
+        with Image.open(output_path) as output:
+            enhanced_image = output.convert('RGB')
+        logger.info("Enhanced image size: %s", enhanced_image.size)
+        
+        return enhanced_image
+        
+    except subprocess.TimeoutExpired:
+        raise Exception("Real-ESRGAN timed out (>180s). Try with a smaller image.")
+    except Exception:
+        logger.exception("Real-ESRGAN enhancement failed")
+        raise
+    finally:
+        retention = config["REALESRGAN_DEBUG_RETENTION_SECONDS"]
+        if retention > 0:
+            debug_root = os.path.join(scratch_root, "debug")
+            _retain_scratch_for_debug(request_dir, debug_root, retention,
+                                      config["REALESRGAN_DEBUG_MAX_MB"] * 1024 ** 2)
+        else:
+            shutil.rmtree(request_dir, ignore_errors=True)
+
+
+def to_rgb_array(image):
+    """
+    Return an HxWx3 uint8 RGB array for a PIL image or NumPy array
+    """
+    if isinstance(image, Image.Image):
+        return np.asarray(image.convert('RGB'))
+    array = np.asarray(image)
+    if array.ndim == 2:
+        array = np.stack([array] * 3, axis=-1)
+    return np.ascontiguousarray(array[..., :3], dtype=np.uint8)
+
+# Rough float32 activation footprint of RRDBNet x4 per input pixel
+REALESRGAN_SCALE = 4
+REALESRGAN_BYTES_PER_PIXEL = 4 * 2600
+
+def _upscale_array(model, device, array):
+    """
+    Run Real-ESRGAN on an RGB uint8 array and return a float32 array in [0, 255]
+    """
+    import torch
+    
+    tensor = torch.from_numpy(np.ascontiguousarray(array)).permute(2, 0, 1).unsqueeze(0)
+    tensor = tensor.to(device).float().div_(255)
+    with torch.inference_mode():
+        output = model(tensor)
+    return output.squeeze(0).clamp_(0, 1).mul_(255).permute(1, 2, 0).cpu().numpy()
+
+def _tile_spans(length, tile, overlap):
+    """
+    Start/end offsets of equally sized, overlapping tiles covering [0, length)
+    """
+    if length <= tile:
+        return [(0, length)]
+    count = int(np.ceil((length - overlap) / (tile - overlap)))
+    starts = np.linspace(0, length - tile, count).round().astype(int)
+    return [(int(start), int(start) + tile) for start in starts]
+
+def _tile_weights(spans, scale, overlap):
+    """
+    Per-tile 1D blending weights at output resolution
+    
+    Neighbouring tiles cross-fade with complementary linear ramps centred in
+    their overlap, so the weights of all tiles sum to one at every pixel
+    """
+    steps = [b[0] - a[0] for a, b in zip(spans, spans[1:])]
+    width = min([overlap] + steps) * scale
+    
+    def rising(positions, boundary):
+        # Weight of the later tile across the boundary between tiles boundary and boundary+1
+        center = (spans[boundary + 1][0] + spans[boundary][1]) * scale / 2
+        if width == 0:
+            return (positions >= center).astype(np.float32)
+        return np.clip((positions - center) / width + 0.5, 0, 1).astype(np.float32)
+    
+    weights = []
+    for index, (start, end) in enumerate(spans):
+        positions = np.arange(start * scale, end * scale) + 0.5
+        w = np.ones(len(positions), dtype=np.float32)
+        if index > 0:
+            w *= rising(positions, index - 1)
+        if index < len(spans) - 1:
+            w *= 1 - rising(positions, index)
+        weights.append(w)
+    return weights
+
+def _choose_tile_size(width, scale, budget_bytes):
+    """
+    Largest input tile side whose forward pass plus strip buffer fits the budget
+    """
+    for tile in range(512, 64, -32):
+        forward = REALESRGAN_BYTES_PER_PIXEL * tile * tile
+        strip = (tile * scale) * (width * scale) * 3 * 4
+        if forward + strip <= budget_bytes:
+            return tile
+    return 64
+
+class BoxDownsampler:
+    """
+    Streaming sink that box-filters enhanced rows down by an integer factor
+    so the full-resolution output never has to exist in memory
+    """
+    def __init__(self, factor):
+        self.factor = factor
+        self.pending = None
+        self.rows = []
+    
+    def __call__(self, offset, rows):
+        if self.pending is not None:
+            rows = np.concatenate([self.pending, rows])
+        usable = (rows.shape[0] // self.factor) * self.factor
+        self.pending = rows[usable:]
+        if usable:
+            self.rows.append(self._reduce(rows[:usable]))
+    
+    def _reduce(self, rows):
+        f = self.factor
+        height, width = rows.shape[0] // f, rows.shape[1] // f
+        blocks = rows[:height * f, :width * f].reshape(height, f, width, f, 3)
+        return blocks.mean(axis=(1, 3), dtype=np.float32).round().astype(np.uint8)
+    
+    def result(self):
+        if self.pending is not None and len(self.pending):
+            # Average the leftover rows into one final row
+            tail = self.pending.mean(axis=0, keepdims=True, dtype=np.float32)
+            self.rows.append(self._reduce(np.repeat(tail, self.factor, axis=0)))
+            self.pending = None
+        return np.concatenate(self.rows)
+
+def enhance_image_tiled(image, tile=None, out=None, sink=None):
+    """
+    Enhance image 4x in overlapping tiles with blended seams
+    
+    Finished output rows are written into out (a preallocated uint8 array,
+    e.g. a np.memmap) or passed to sink(row_offset, rows); only one strip of
+    tiles is held in memory at a time. Returns out, or None when streaming
+    """
+    config = load_config()
+    model, device = load_realesrgan_model()
+    array = to_rgb_array(image)
+    height, width = array.shape[:2]
+    scale = REALESRGAN_SCALE
+    overlap = config["REALESRGAN_TILE_OVERLAP"]
+    
+    if tile is None:
+        tile = _choose_tile_size(width, scale, config["REALESRGAN_PEAK_MEMORY_MB"] * 1024 ** 2)
+    tile = max(tile, 2 * overlap + 1)
+    if out is None and sink is None:
+        out = np.empty((height * scale, width * scale, 3), dtype=np.uint8)
+    
+    def emit(offset, rows):
+        rows = np.clip(rows, 0, 255).round().astype(np.uint8)
+        if out is not None:
+            out[offset:offset + rows.shape[0]] = rows
+        if sink is not None:
+            sink(offset, rows)
+    
+    y_spans = _tile_spans(height, tile, overlap)
+    x_spans = _tile_spans(width, tile, overlap)
+    y_weights = _tile_weights(y_spans, scale, overlap)
+    x_weights = _tile_weights(x_spans, scale, overlap)
+    
+    strip_height = (y_spans[0][1] - y_spans[0][0]) * scale
+    strip = np.zeros((strip_height, width * scale, 3), dtype=np.float32)
+    strip_top = 0
+    
+    for y_index, (y0, y1) in enumerate(y_spans):
+        top = y0 * scale
+        if top > strip_top:
+            # Rows above this strip are not covered by any later tile
+            done = top - strip_top
+            emit(strip_top, strip[:done])
+            strip[:strip_height - done] = strip[done:].copy()
+            strip[strip_height - done:] = 0
+            strip_top = top
+        
+        for x_index, (x0, x1) in enumerate(x_spans):
+            upscaled = _upscale_array(model, device, array[y0:y1, x0:x1])
+            weights = y_weights[y_index][:, None, None] * x_weights[x_index][None, :, None]
+            strip[:, x0 * scale:x1 * scale] += upscaled * weights
+    
+    emit(strip_top, strip)
+    return out
+
+def enhance_image_inprocess(image):
+    """
+    Enhance image 4x using the cached Real-ESRGAN model in this process
+    Accepts a PIL image or RGB NumPy array and returns the same type
+    
+    Images whose forward pass would exceed REALESRGAN_PEAK_MEMORY_MB are
+    processed in tiles, and outputs above REALESRGAN_MAX_OUTPUT_MEGAPIXELS
+    are streamed through a box filter instead of being built at full size
+    """
+    config = load_config()
+    model, device = load_realesrgan_model()
+    array = to_rgb_array(image)
+    height, width = array.shape[:2]
+    scale = REALESRGAN_SCALE
+    
+    budget = config["REALESRGAN_PEAK_MEMORY_MB"] * 1024 ** 2
+    output_megapixels = height * width * scale * scale / 1e6
+    max_megapixels = config["REALESRGAN_MAX_OUTPUT_MEGAPIXELS"]
+    
+    if output_megapixels > max_megapixels:
+        factor = int(np.ceil(np.sqrt(output_megapixels / max_megapixels)))
+        downsampler = BoxDownsampler(factor)
+        enhance_image_tiled(array, sink=downsampler)
+        output = downsampler.result()
+        print(f"✓ Streamed {output_megapixels:.0f} MP enhancement down {factor}x to {output.shape[1]}x{output.shape[0]}")
+    elif REALESRGAN_BYTES_PER_PIXEL * height * width > budget:
+        output = enhance_image_tiled(array)
+    else:
+        output = np.clip(_upscale_array(model, device, array), 0, 255).round().astype(np.uint8)
+    
+    if isinstance(image, Image.Image):
+        return Image.fromarray(output)
+    return output
+
+def downsample_for_classifier(image, imgsz):
+    """
+    Shrink image so its short side is imgsz / 4, the size Real-ESRGAN
+    has to start from to land exactly on the classifier input size
+    """
+    image = Image.fromarray(to_rgb_array(image)) if not isinstance(image, Image.Image) else image.convert('RGB')
+    width, height = image.size
+    low_short = int(np.ceil(imgsz / REALESRGAN_SCALE))
+    if min(width, height) <= low_short:
+        return image
+    ratio = low_short / min(width, height)
+    size = (max(low_short, round(width * ratio)), max(low_short, round(height * ratio)))
+    return image.resize(size, Image.LANCZOS, reducing_gap=2.0)
+
+def enhance_image(image):
+    """
+    Enhance image with the Real-ESRGAN backend selected in the config
+    
+    In "classify" mode the image is first reduced to about 56 px on the short
+    side and only super-resolved up to the 224 px that detect_disease uses
+    """
+    if not isinstance(image, Image.Image):
+        image = Image.fromarray(to_rgb_array(image))
+    cache = load_result_cache()
+    if cache is None:
+        return _enhance_image_uncached(image)
+    
+    key = enhancement_cache_key(image_hash(image))
+    enhanced = cache.get_enhanced(key)
+    if enhanced is None:
+        enhanced = _enhance_image_uncached(image)
+        cache.put_enhanced(key, enhanced)
+    return enhanced
+
+@timed("enhance")
+def _enhance_image_uncached(image):
+    config = load_config()
+    classify_mode = config["ENHANCEMENT_MODE"] == "classify"
+    if classify_mode:
+        imgsz = config["YOLO_IMGSZ"]
+        image = downsample_for_classifier(image, imgsz)
+    
+    if config["REALESRGAN_INPROCESS"]:
+        enhanced = enhance_image_inprocess(image)
+    else:
+        enhanced = enhance_image_with_realesrgan(image)
+    
+    if classify_mode and min(enhanced.size) != imgsz:
+        ratio = imgsz / min(enhanced.size)
+        size = (max(imgsz, round(enhanced.width * ratio)), max(imgsz, round(enhanced.height * ratio)))
+        enhanced = enhanced.resize(size, Image.BICUBIC)
+    return enhanced
+
+
+# ==============================
+# RESULT CACHE
+# ==============================
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+@cache_resource
+def model_weights_hash(path):
+    """
+    Hash of a weights file, computed once per path
+    """
+    return file_sha256(path)
+
+def image_hash(image):
+    """
+    Hash of the decoded pixels, so re-encoded uploads of the same photo still match
+    """
+    array = to_rgb_array(image)
+    digest = hashlib.sha256(str(array.shape).encode())
+    digest.update(np.ascontiguousarray(array).data)
+    return digest.hexdigest()
+
+class ResultCache:
+    """
+    LRU cache with predictions kept in memory and enhanced images kept on disk
+    Keys combine the pixel hash, the weights hash and the settings that affect the output
+    """
+    def __init__(self, cache_dir, max_predictions, max_disk_bytes):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_predictions = max_predictions
+        self.max_disk_bytes = max_disk_bytes
+        self.predictions = OrderedDict()
+        self.files = OrderedDict()
+        self.disk_bytes = 0
+        self.counters = {"prediction_hits": 0, "prediction_misses": 0,
+                         "enhancement_hits": 0, "enhancement_misses": 0}
+        self.lock = threading.Lock()
+        
+        # Index what earlier runs left behind, oldest first
+        for path in sorted(self.cache_dir.glob("*.png"), key=lambda p: p.stat().st_mtime):
+            size = path.stat().st_size
+            self.files[path.stem] = size
+            self.disk_bytes += size
+        self._evict_files()
+    
+    def get_prediction(self, key):
+        with self.lock:
+            result = self.predictions.get(key)
+            if result is not None:
+                self.predictions.move_to_end(key)
+            self.counters["prediction_hits" if result is not None else "prediction_misses"] += 1
+        load_metrics().inc("plantcare_cache_requests_total", cache="prediction",
+                           result="hit" if result is not None else "miss")
+        return result
+    
+    def put_prediction(self, key, result):
+        with self.lock:
+            self.predictions[key] = result
+            self.predictions.move_to_end(key)
+            while len(self.predictions) > self.max_predictions:
+                self.predictions.popitem(last=False)
+    
+    def get_enhanced(self, key):
+        with self.lock:
+            hit = key in self.files
+            if hit:
+                self.files.move_to_end(key)
+            self.counters["enhancement_hits" if hit else "enhancement_misses"] += 1
+        load_metrics().inc("plantcare_cache_requests_total", cache="enhancement", result="hit" if hit else "miss")
+        if not hit:
+            return None
+        try:
+            return Image.open(self.cache_dir / f"{key}.png").convert('RGB')
+        except OSError:
+            with self.lock:
+                self.disk_bytes -= self.files.pop(key, 0)
+            return None
+    
+    def put_enhanced(self, key, image):
+        path = self.cache_dir / f"{key}.png"
+        # Write under a temporary name so readers never see a partial file
+        tmp_path = self.cache_dir / f"{key}.{threading.get_ident()}.tmp"
+        image.save(tmp_path, "PNG")
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.disk_bytes -= self.files.pop(key, 0)
+            self.files[key] = path.stat().st_size
+            self.disk_bytes += self.files[key]
+            self._evict_files()
+    
+    def _evict_files(self):
+        while self.disk_bytes > self.max_disk_bytes and self.files:
+            key, size = self.files.popitem(last=False)
+            self.disk_bytes -= size
+            try:
+                os.unlink(self.cache_dir / f"{key}.png")
+            except OSError:
+                pass
+    
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, predictions=len(self.predictions),
+                        enhanced_images=len(self.files), disk_bytes=self.disk_bytes)
+
+@cache_resource
+def load_result_cache():
+    config = load_config()
+    if not config["CACHE_ENABLED"]:
+        return None
+    return ResultCache(config["CACHE_DIR"], config["CACHE_MAX_PREDICTIONS"],
+                       config["CACHE_MAX_DISK_MB"] * 1024 ** 2)
+
+def prediction_cache_key(pixels_hash, weights):
+    """
+    weights identifies the checkpoints that produce the prediction (SHA-256,
+    plus the ensemble members and their weights when the ensemble is on)
+    """
+    config = load_config()
+    settings = f"imgsz={config['YOLO_IMGSZ']}|backend={config['YOLO_BACKEND']}"
+    if config["TTA_ENABLED"]:
+        settings += f"|tta={config['TTA_CONFIDENCE_THRESHOLD']}"
+    if config["ENSEMBLE_ENABLED"]:
+        settings += f"|ensemble={config['ENSEMBLE_PRIMARY_WEIGHT']}@{config['ENSEMBLE_EXIT_CONFIDENCE']}"
+    if config["CASCADE_ENABLED"]:
+        settings += f"|cascade={config['CASCADE_TINY_IMGSZ']}@{config['CASCADE_TINY_CONFIDENCE']}"
+    return hashlib.sha256(f"{pixels_hash}|{weights}|{settings}".encode()).hexdigest()
+
+def enhancement_cache_key(pixels_hash):
+    config = load_config()
+    weights = model_weights_hash(config["MODEL_REALESRGAN_PATH"])
+    settings = (f"mode={config['ENHANCEMENT_MODE']}|imgsz={config['YOLO_IMGSZ']}"
+                f"|max_mp={config['REALESRGAN_MAX_OUTPUT_MEGAPIXELS']}")
+    return hashlib.sha256(f"{pixels_hash}|{weights}|{settings}".encode()).hexdigest()
+
+
+# ==============================
+# ADAPTIVE ENHANCEMENT GATE
+# ==============================
+@timed("quality_gate")
+def image_quality_score(image, crop=1024):
+    """
+    Cheap no-reference quality measures on a native-resolution centre crop
+    - sharpness: variance of the Laplacian (low means blurry)
+    - blockiness: mean gradient across 8x8 JPEG block edges relative to elsewhere
+    
+    Images that decode_image reduced are scored from their original upload,
+    since DCT scaling and resizing remove the block grid and change the blur
+    """
+    source = image.info.get("native_source") if isinstance(image, Image.Image) else None
+    if source is not None:
+        # Stored orientation is fine: both measures are symmetric in x and y
+        with Image.open(io.BytesIO(source)) as native:
+            return image_quality_score(native.convert('RGB'), crop)
+    array = to_rgb_array(image)
+    height, width = array.shape[:2]
+    
+    # Keep the crop aligned to the 8x8 JPEG grid
+    top = max(0, (height - crop) // 2) // 8 * 8
+    left = max(0, (width - crop) // 2) // 8 * 8
+    patch = array[top:top + crop, left:left + crop]
+    gray = patch.astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    
+    laplacian = (gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:]
+                 - 4 * gray[1:-1, 1:-1])
+    sharpness = float(laplacian.var()) if laplacian.size else 0.0
+    
+    def edge_ratio(diffs):
+        if diffs.shape[1] < 16:
+            return 1.0
+        on_edge = np.zeros(diffs.shape[1], dtype=bool)
+        on_edge[7::8] = True
+        inside = diffs[:, ~on_edge].mean()
+        return float(diffs[:, on_edge].mean() / inside) if inside > 0 else 1.0
+    
+    blockiness = (edge_ratio(np.abs(np.diff(gray, axis=1)))
+                  + edge_ratio(np.abs(np.diff(gray, axis=0)).T)) / 2
+    
+    return {
+        "sharpness": sharpness,
+        "blockiness": blockiness,
+        "short_side": int(min(height, width)),
+        "megapixels": height * width / 1e6,
+    }
+
+def gate_quality(image, original_conf):
+    """
+    Quality scores for the gate, or None when the confidence alone already
+    skips enhancement (scoring a reduced upload means a full-resolution decode)
+    """
+    if original_conf >= load_config()["ENHANCE_SKIP_CONFIDENCE"]:
+        return None
+    return image_quality_score(image)
+
+def enhancement_decision(original_conf, quality):
+    """
+    Decide whether Real-ESRGAN is worth running
+    Returns (enhance, reason); quality is only read below the confidence threshold
+    """
+    config = load_config()
+    threshold = config["ENHANCE_SKIP_CONFIDENCE"]
+    if original_conf >= threshold:
+        return False, f"Original confidence {original_conf*100:.1f}% is above the {threshold*100:.0f}% threshold"
+    
+    problems = []
+    if quality["sharpness"] < config["ENHANCE_BLUR_THRESHOLD"]:
+        problems.append(f"image looks blurry (sharpness {quality['sharpness']:.0f})")
+    if quality["short_side"] < config["YOLO_IMGSZ"]:
+        problems.append(f"low resolution ({quality['short_side']} px short side)")
+    if quality["blockiness"] > config["ENHANCE_BLOCKINESS_THRESHOLD"]:
+        problems.append(f"strong JPEG artifacts (blockiness {quality['blockiness']:.2f})")
+    
+    if not problems:
+        return False, "Image is sharp and high resolution, enhancement is unlikely to help"
+    return True, f"Low confidence ({original_conf*100:.1f}%) and " + ", ".join(problems)
+
+
+# ==============================
+# DISEASE DETECTION
+# ==============================
+def preprocess_image(image, imgsz):
+    """
+    Resize the short side to imgsz and centre-crop, matching YOLO's classify transforms
+    Returns a 3 x imgsz x imgsz float32 array in [0, 1]
+    """
+    if isinstance(image, Image.Image):
+        image = image.convert('RGB')
+    else:
+        image = Image.fromarray(to_rgb_array(image))
+    width, height = image.size
+    ratio = imgsz / min(width, height)
+    resized = image.resize((max(imgsz, int(width * ratio)), max(imgsz, int(height * ratio))), Image.BILINEAR)
+    left = (resized.width - imgsz) // 2
+    top = (resized.height - imgsz) // 2
+    cropped = resized.crop((left, top, left + imgsz, top + imgsz))
+    return np.asarray(cropped, dtype=np.float32).transpose(2, 0, 1) / 255
+
+def predict_probs(model, device, batch):
+    """
+    Run the classifier on an N x 3 x H x W float32 batch, returns N x C probabilities
+    """
+    if isinstance(model, OnnxClassifier):
+        return model.predict(batch)
+    
+    import torch
+    tensor = torch.from_numpy(np.ascontiguousarray(batch)).to(device)
+    with torch.inference_mode():
+        output = model.model(tensor)
+    # Newer ultralytics returns (probs, logits) in eval mode
+    if isinstance(output, (list, tuple)):
+        output = output[0]
+    return output.float().cpu().numpy()
+
+def summarize_probs(probs):
+    """
+    Top-1 / top-5 summary for one probability vector
+    """
+    top5 = np.argsort(probs)[::-1][:5]
+    return {
+        "class": CLASS_NAMES[int(top5[0])],
+        "confidence": float(probs[top5[0]]),
+        "top5": [(CLASS_NAMES[int(i)], float(probs[i])) for i in top5],
+        "probs": probs,
+    }
+
+class PreparedImage:
+    """
+    An image with its per-image CPU work done: the pixel hash for the result
+    cache and the preprocessed model inputs, keyed by input size
+    """
+    def __init__(self, image, sizes=()):
+        self.image = image
+        self.pixels_hash = image_hash(image) if load_config()["CACHE_ENABLED"] else None
+        self.tensors = {}
+        for imgsz in sizes:
+            self.tensor(imgsz)
+    
+    def tensor(self, imgsz):
+        if imgsz not in self.tensors:
+            self.tensors[imgsz] = preprocess_image(self.image, imgsz)
+        return self.tensors[imgsz]
+    
+    def cache_key(self, weights):
+        return prediction_cache_key(self.pixels_hash or image_hash(self.image), weights)
+
+def prepare_images(images, cascade=True):
+    """
+    Hash and preprocess images on the calling thread, for every input size
+    the classification will need; PreparedImage items are passed through
+    """
+    config = load_config()
+    sizes = [config["YOLO_IMGSZ"]]
+    if cascade and config["CASCADE_ENABLED"]:
+        sizes.append(config["CASCADE_TINY_IMGSZ"])
+    with load_metrics().span("preprocess"):
+        return [image if isinstance(image, PreparedImage) else PreparedImage(image, sizes) for image in images]
+
+def tta_views(image, imgsz):
+    """
+    Cheap test-time augmentations of one image as a 9 x 3 x imgsz x imgsz batch:
+    the centre crop, its flips and 90 degree rotations, and the four corner
+    crops of a slightly larger resize
+    """
+    base = preprocess_image(image, imgsz)
+    views = [
+        base,
+        base[:, :, ::-1],
+        base[:, ::-1, :],
+        np.rot90(base, 1, axes=(1, 2)),
+        np.rot90(base, 3, axes=(1, 2)),
+    ]
+    large = preprocess_image(image, int(round(imgsz * 1.15)))
+    margin = large.shape[1] - imgsz
+    views += [
+        large[:, :imgsz, :imgsz], large[:, :imgsz, margin:],
+        large[:, margin:, :imgsz], large[:, margin:, margin:],
+    ]
+    return np.stack(views)
+
+@cache_resource
+def load_cascade_model():
+    """
+    Dedicated first cascade stage (e.g. a distilled student), or None to
+    run the served checkpoint at CASCADE_TINY_IMGSZ instead
+    """
+    config = load_config()
+    if not config["CASCADE_TINY_WEIGHTS"]:
+        return None
+    version = ModelVersion(config["CASCADE_TINY_WEIGHTS"], config["YOLO_BACKEND"])
+    imgsz = config["CASCADE_TINY_IMGSZ"]
+    dummy = np.zeros((1, 3, imgsz, imgsz), dtype=np.float32)
+    for _ in range(config["WARMUP_ITERATIONS"]):
+        predict_probs(version.model, version.device, dummy)
+    print(f"✓ Cascade first stage {version.name} at {imgsz} px")
+    return version
+
+def cascade_first_stage(version, images, indices, batch_size):
+    """
+    Score images with the cheap first cascade stage
+    Returns {index: result} for the images it is confident about; the others escalate
+    """
+    config = load_config()
+    tiny = load_cascade_model() or version
+    imgsz = config["CASCADE_TINY_IMGSZ"]
+    name = f"{tiny.name}/{imgsz}px"
+    accepted = {}
+    for start in range(0, len(indices), batch_size):
+        chunk = indices[start:start + batch_size]
+        batch = np.stack([images[i].tensor(imgsz) for i in chunk])
+        probs = predict_probs(tiny.model, tiny.device, batch)
+        for i, p in zip(chunk, probs):
+            if p.max() >= config["CASCADE_TINY_CONFIDENCE"]:
+                accepted[i] = dict(summarize_probs(p), model_version=name, cascade_stage="tiny")
+    
+    metrics = load_metrics()
+    metrics.inc("plantcare_cascade_total", len(accepted), stage="tiny", result="accepted")
+    metrics.inc("plantcare_cascade_total", len(indices) - len(accepted), stage="tiny", result="escalated")
+    return accepted
+
+def cascade_stats():
+    """
+    Share of requests each cascade stage passed on to the next one
+    """
+    counters = load_metrics().counter_values().get("plantcare_cascade_total", {})
+    stats = {}
+    for stage in ("tiny", "full"):
+        accepted = counters.get(f"result=accepted, stage={stage}", 0)
+        escalated = counters.get(f"result=escalated, stage={stage}", 0)
+        total = accepted + escalated
+        stats[stage] = {"requests": total, "escalated": escalated,
+                        "escalation_rate": escalated / total if total else None}
+    return stats
+
+@cache_resource
+def load_ensemble_members():
+    """
+    Extra checkpoints averaged with the served model, as (ModelVersion, weight) pairs
+    """
+    config = load_config()
+    imgsz = config["YOLO_IMGSZ"]
+    dummy = np.zeros((1, 3, imgsz, imgsz), dtype=np.float32)
+    members = []
+    for member in config["ENSEMBLE_MEMBERS"]:
+        version = ModelVersion(member["weights"], config["YOLO_BACKEND"])
+        for _ in range(config["WARMUP_ITERATIONS"]):
+            predict_probs(version.model, version.device, dummy)
+        print(f"✓ Ensemble member {version.name} (weight {member['weight']})")
+        members.append((version, member["weight"]))
+    return members
+
+def predict_ensemble(primary_probs, batch, members, primary_weight, exit_confidence):
+    """
+    Weighted average of the ensemble members' probabilities over a preprocessed batch
+    
+    Rows the served model already predicts with at least exit_confidence keep
+    its probabilities; only the remaining rows go through the other members.
+    Returns (probs, escalated) where escalated marks the averaged rows
+    """
+    escalated = primary_probs.max(axis=1) < exit_confidence
+    if not members or not escalated.any():
+        return primary_probs, escalated
+    subset = batch[escalated]
+    # M x N x C, reduced with one weighted sum over the member axis
+    stacked = np.stack([primary_probs[escalated]] +
+                       [predict_probs(version.model, version.device, subset) for version, _ in members])
+    weights = np.array([primary_weight] + [weight for _, weight in members], dtype=np.float32)
+    probs = primary_probs.copy()
+    probs[escalated] = np.tensordot(weights / weights.sum(), stacked, axes=1)
+    return probs, escalated
+
+@timed("tta")
+def predict_tta(model, device, images, imgsz):
+    """
+    Average the probabilities over the TTA views of each image
+    All views of all images go through the network as one batch
+    """
+    if not images:
+        return []
+    views = [tta_views(image, imgsz) for image in images]
+    probs = predict_probs(model, device, np.concatenate(views))
+    return probs.reshape(len(images), len(views[0]), -1).mean(axis=1)
+
+def detect_diseases(images, batch_size=None, cascade=True):
+    """
+    Classify several images with one forward pass per batch
+    Returns a list of dicts with class, confidence, top5, the full probs vector
+    and the model_version that produced them
+    cascade=False skips the cheap first stage even when CASCADE_ENABLED is set
+    images may be PIL images or PreparedImage items from prepare_images
+    """
+    images = prepare_images(images, cascade)
+    # All images of the call use one version, even if a reload swaps models meanwhile
+    with load_model_manager().acquire() as version:
+        return _detect_diseases(version, images, batch_size, cascade)
+
+def _detect_diseases(version, images, batch_size, cascade=True):
+    model, device = version.model, version.device
+    config = load_config()
+    batch_size = batch_size or config["YOLO_BATCH_SIZE"]
+    imgsz = config["YOLO_IMGSZ"]
+    
+    members, weights_key, ensemble_version = [], version.sha256, version.name
+    if config["ENSEMBLE_ENABLED"]:
+        # A member that is also the served checkpoint would only be counted twice
+        members = [(member, weight) for member, weight in load_ensemble_members() if member.sha256 != version.sha256]
+        weights_key = "|".join([version.sha256] + [f"{member.sha256}:{weight}" for member, weight in members])
+        ensemble_version = "+".join([version.name] + [member.name for member, _ in members])
+    cascade = cascade and config["CASCADE_ENABLED"]
+    if cascade:
+        tiny = load_cascade_model()
+        weights_key += f"|tiny={tiny.sha256 if tiny is not None else 'served'}"
+    
+    cache = load_result_cache()
+    results = [None] * len(images)
+    keys = [None] * len(images)
+    if cache is not None:
+        for i, image in enumerate(images):
+            keys[i] = image.cache_key(weights_key)
+            results[i] = cache.get_prediction(keys[i])
+    pending = [i for i, result in enumerate(results) if result is None]
+    
+    metrics = load_metrics()
+    full_pending = pending
+    averaged = set()
+    if cascade and pending:
+        with metrics.span("cascade_tiny"):
+            accepted = cascade_first_stage(version, images, pending, batch_size)
+        for i, result in accepted.items():
+            results[i] = result
+        full_pending = [i for i in pending if i not in accepted]
+    
+    for start in range(0, len(full_pending), batch_size):
+        indices = full_pending[start:start + batch_size]
+        # The images go to the network in memory, no JPEG re-encode or temp file
+        batch = np.stack([images[i].tensor(imgsz) for i in indices])
+        with metrics.span("forward"):
+            probs = predict_probs(model, device, batch)
+        escalated = np.zeros(len(indices), dtype=bool)
+        if members:
+            with metrics.span("ensemble"):
+                probs, escalated = predict_ensemble(probs, batch, members, config["ENSEMBLE_PRIMARY_WEIGHT"],
+                                                    config["ENSEMBLE_EXIT_CONFIDENCE"])
+            metrics.inc("plantcare_ensemble_total", int(escalated.sum()), result="escalated")
+            metrics.inc("plantcare_ensemble_total", int((~escalated).sum()), result="early_exit")
+        for i, p, full in zip(indices, probs, escalated):
+            results[i] = dict(summarize_probs(p), model_version=ensemble_version if full else version.name)
+            if full:
+                averaged.add(i)
+            if cascade:
+                results[i]["cascade_stage"] = "full"
+    
+    if config["TTA_ENABLED"]:
+        # The ensemble average wins over TTA: re-scoring it with the served model alone would discard it
+        uncertain = [i for i in full_pending if i not in averaged
+                     and results[i]["confidence"] < config["TTA_CONFIDENCE_THRESHOLD"]]
+        for i, probs in zip(uncertain, predict_tta(model, device, [images[i].image for i in uncertain], imgsz)):
+            results[i] = dict(results[i], **summarize_probs(probs), tta=True, model_version=version.name)
+    
+    for i in pending:
+        metrics.observe("plantcare_prediction_confidence", results[i]["confidence"])
+    if cache is not None:
+        for i in pending:
+            cache.put_prediction(keys[i], results[i])
+    return results
+
+def detect_disease(image):
+    result = detect_diseases([image])[0]
+    return result["class"], result["confidence"]
+
+# ==============================
+# MICRO-BATCHING SCHEDULER
+# ==============================
+class BatchScheduler:
+    """
+    Collects classification requests from concurrent sessions and API calls
+    and runs them as one batched forward pass
+    
+    A batch is closed when it reaches max_batch images or when the oldest
+    request has waited max_wait_ms, so tail latency stays bounded
+    """
+    def __init__(self, max_batch, max_wait_ms):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.batch_sizes = Counter()
+        self.queue_depths = Counter()
+        self.max_queue_depth = 0
+        self.worker = threading.Thread(target=self._run, name="plantcare-batcher", daemon=True)
+        self.worker.start()
+    
+    def submit(self, image, cascade=True):
+        future = Future()
+        self.requests.put((image, future, time.perf_counter(), cascade))
+        return future
+    
+    def _collect(self):
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+    
+    def _run(self):
+        while True:
+            batch = self._collect()
+            depth = self.requests.qsize()
+            with self.lock:
+                self.batch_sizes[len(batch)] += 1
+                self.queue_depths[depth] += 1
+                self.max_queue_depth = max(self.max_queue_depth, depth)
+            
+            started = time.perf_counter()
+            metrics = load_metrics()
+            for _, _, submitted, _ in batch:
+                metrics.observe("plantcare_stage_duration_seconds", started - submitted, stage="queue_wait")
+            
+            # Skip requests whose caller already cancelled them
+            live = [(image, future, cascade) for image, future, _, cascade in batch
+                    if future.set_running_or_notify_cancel()]
+            for cascade in (True, False):
+                group = [(image, future) for image, future, flag in live if flag == cascade]
+                if not group:
+                    continue
+                try:
+                    results = detect_diseases([image for image, _ in group], self.max_batch, cascade)
+                except Exception as e:
+                    for _, future in group:
+                        future.set_exception(e)
+                    continue
+                for (_, future), result in zip(group, results):
+                    future.set_result(result)
+    
+    def stats(self):
+        with self.lock:
+            return {
+                "queue_depth": self.requests.qsize(),
+                "max_queue_depth": self.max_queue_depth,
+                "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+                "queue_depth_histogram": dict(sorted(self.queue_depths.items())),
+            }
+
+@cache_resource
+def load_batch_scheduler():
+    config = load_config()
+    return BatchScheduler(config["MICRO_BATCH_MAX_SIZE"], config["MICRO_BATCH_MAX_WAIT_MS"])
+
+def classify_images(images, cascade=True):
+    """
+    Classify images through the shared scheduler, or directly when it is disabled
+    Enhanced images pass cascade=False: they only exist because the original
+    was hard, so the full model gives their answer
+    """
+    if not load_config()["MICRO_BATCHING"]:
+        return detect_diseases(images, cascade=cascade)
+    scheduler = load_batch_scheduler()
+    # Hashing and preprocessing run here, in parallel across callers, so the
+    # single batcher thread only stacks ready tensors and runs the forward pass
+    futures = [scheduler.submit(image, cascade) for image in prepare_images(images, cascade)]
+    return [future.result() for future in futures]
+
+def needs_full_model(result):
+    """
+    Whether a first-stage cascade answer has to be re-scored by the full model
+    before the enhancement gate: enhancement only ever follows the full model
+    """
+    return result.get("cascade_stage") == "tiny" and result["confidence"] < load_config()["ENHANCE_SKIP_CONFIDENCE"]
+
+def classify_full(image):
+    """
+    Classify one image with the full model, skipping the cascade first stage
+    """
+    return dict(classify_images([image], cascade=False)[0], cascade_stage="full")
+
+
+# ==============================
+# ANALYSIS PIPELINE
+# ==============================
+@timed("decode")
+def decode_image(data, short_side=None):
+    """
+    Decode an upload (bytes or file-like) to one compact RGB image shared by
+    display, enhancement and classification
+    
+    JPEGs are decoded straight at a reduced DCT scale (1/2, 1/4, 1/8) to the
+    smallest size whose short side is still >= short_side, EXIF orientation is
+    applied once, and anything still larger is resized down to short_side
+    
+    A reduced image keeps the upload bytes in info["native_source"], so the
+    enhancement gate can still measure quality at native resolution
+    """
+    short_side = short_side or load_config()["INGEST_SHORT_SIDE"]
+    if not isinstance(data, (bytes, bytearray)):
+        data = data.read()
+    source = bytes(data)
+    try:
+        with Image.open(io.BytesIO(source)) as image:
+            width, height = image.size
+            load_metrics().observe("plantcare_input_megapixels", width * height / 1e6)
+            # EXIF orientations 5-8 swap width and height, but the short side is the same either way
+            ratio = short_side / min(width, height)
+            if ratio < 1:
+                image.draft('RGB', (int(np.ceil(width * ratio)), int(np.ceil(height * ratio))))
+            image = ImageOps.exif_transpose(image).convert('RGB')
+    except Exception as e:
+        raise ValueError(f"Could not decode image: {e}")
+    
+    if min(image.size) > short_side:
+        ratio = short_side / min(image.size)
+        size = (max(short_side, round(image.width * ratio)), max(short_side, round(image.height * ratio)))
+        image = image.resize(size, Image.LANCZOS, reducing_gap=2.0)
+    if min(image.size) < min(width, height):
+        image.info["native_source"] = source
+    return image
+
+def _new_analysis():
+    return {
+        "original": None,
+        "enhanced": None,
+        "enhanced_image": None,
+        "used_enhancement": False,
+        "used_which": "original",
+        "enhancement_reason": None,
+        "enhancement_error": None,
+        "image_quality": None,
+        "model_version": None,
+    }
+
+def _finish_analysis(analysis):
+    final = analysis["original"]
+    if analysis["enhanced"] is not None:
+        analysis["used_enhancement"] = True
+        # Compare results and use the one with higher confidence
+        if analysis["enhanced"]["confidence"] > analysis["original"]["confidence"]:
+            final = analysis["enhanced"]
+            analysis["used_which"] = "enhanced"
+    
+    analysis["final_class"] = final["class"]
+    analysis["final_conf"] = final["confidence"]
+    analysis["model_version"] = final["model_version"]
+    
+    # With the cascade on, enhancement is the stage after the full model
+    stage = analysis["original"].get("cascade_stage")
+    if stage == "full" and (analysis["enhancement_reason"] or analysis["enhancement_error"] or analysis["enhanced"]):
+        escalated = analysis["enhanced"] is not None or analysis["enhancement_error"] is not None
+        load_metrics().inc("plantcare_cascade_total", stage="full", result="escalated" if escalated else "accepted")
+    
+    if analysis["enhancement_error"] is not None:
+        load_metrics().inc("plantcare_enhancement_total", outcome="failed")
+    elif analysis["enhanced"] is not None:
+        load_metrics().inc("plantcare_enhancement_total", outcome="used")
+    elif analysis["enhancement_reason"]:
+        load_metrics().inc("plantcare_enhancement_total", outcome="skipped")
+    return analysis
+
+def analyze_plant(image, use_enhancement):
+    """
+    Classify image, optionally enhance it, and keep the more confident result
+    Shared by the Streamlit UI and the HTTP service; image may also be raw bytes
+    """
+    metrics = load_metrics()
+    metrics.inc("plantcare_requests_total", enhancement="on" if use_enhancement else "off")
+    with metrics.span("analyze"):
+        if load_config()["PIPELINE_ENABLED"]:
+            return load_analysis_pipeline().submit(image, use_enhancement).result()
+        if not isinstance(image, Image.Image):
+            image = decode_image(image)
+        return _analyze_plant_sequential(image, use_enhancement)
+
+def _analyze_plant_sequential(image, use_enhancement):
+    config = load_config()
+    adaptive = use_enhancement and config["ADAPTIVE_ENHANCEMENT"]
+    analysis = _new_analysis()
+    
+    if use_enhancement and not adaptive:
+        # Enhance first so the original and enhanced images share one forward pass
+        try:
+            analysis["enhanced_image"] = enhance_image(image)
+        except Exception as e:
+            analysis["enhancement_error"] = str(e)
+        
+        images = [image] if analysis["enhanced_image"] is None else [image, analysis["enhanced_image"]]
+        # Enhancement always runs here, so the original skips the cascade first stage too
+        results = classify_images(images, cascade=False)
+        analysis["original"] = results[0]
+        if len(results) > 1:
+            analysis["enhanced"] = results[1]
+    else:
+        # Detect on original
+        analysis["original"] = classify_images([image])[0]
+        if adaptive and needs_full_model(analysis["original"]):
+            analysis["original"] = classify_full(image)
+        
+        # Decide whether enhancement can help before paying for it
+        run_enhancement = False
+        if adaptive:
+            quality = gate_quality(image, analysis["original"]["confidence"])
+            run_enhancement, reason = enhancement_decision(analysis["original"]["confidence"], quality)
+            analysis["enhancement_reason"] = reason
+            analysis["image_quality"] = quality
+        
+        if run_enhancement:
+            try:
+                analysis["enhanced_image"] = enhance_image(image)
+                analysis["enhanced"] = classify_images([analysis["enhanced_image"]], cascade=False)[0]
+            except Exception as e:
+                analysis["enhancement_error"] = str(e)
+                analysis["enhancement_reason"] = None
+    
+    return _finish_analysis(analysis)
+
+
+# ==============================
+# PIPELINED STAGE EXECUTION
+# ==============================
+class AnalysisPipeline:
+    """
+    Runs decode, enhancement and classification on separate bounded worker pools
+    
+    Stages are chained with futures, so the original image is classified while
+    Real-ESRGAN is still working and different requests overlap with each other.
+    Enhancement has its own small pool, so long super-resolution jobs cannot
+    occupy the threads that short classification requests need
+    """
+    def __init__(self, decode_workers, enhance_workers, classify_workers, max_in_flight):
+        self.decode_pool = ThreadPoolExecutor(decode_workers, thread_name_prefix="plantcare-decode")
+        self.enhance_pool = ThreadPoolExecutor(enhance_workers, thread_name_prefix="plantcare-enhance")
+        self.classify_pool = ThreadPoolExecutor(classify_workers, thread_name_prefix="plantcare-classify")
+        # Admission control: callers block once this many analyses are in flight
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+    
+    def submit(self, image, use_enhancement):
+        """
+        Start an analysis of a PIL image or raw image bytes, returns a Future of the analysis dict
+        """
+        self.slots.acquire()
+        request = _PipelineRequest(self, use_enhancement)
+        request.future.add_done_callback(lambda _: self.slots.release())
+        request.start(image)
+        return request.future
+
+class _PipelineRequest:
+    """
+    State of one analysis moving through the pipeline stages
+    
+    Every scheduled stage holds a reference; the analysis is finished when
+    the last one completes, or failed as soon as a required stage fails
+    """
+    def __init__(self, pipeline, use_enhancement):
+        self.pipeline = pipeline
+        self.use_enhancement = use_enhancement
+        self.adaptive = use_enhancement and load_config()["ADAPTIVE_ENHANCEMENT"]
+        self.analysis = _new_analysis()
+        self.image = None
+        self.future = Future()
+        self.lock = threading.Lock()
+        # Held by start() until the first stages have been scheduled
+        self.outstanding = 1
+    
+    def start(self, image):
+        try:
+            if isinstance(image, Image.Image):
+                self.on_decoded(image)
+            else:
+                self.chain(self.pipeline.decode_pool.submit(decode_image, image), self.on_decoded)
+        except Exception as e:
+            self.fail(e)
+        finally:
+            self.release()
+    
+    def chain(self, future, callback, wants_future=False):
+        with self.lock:
+            self.outstanding += 1
+        future.add_done_callback(lambda done: self._run_callback(done, callback, wants_future))
+    
+    def _run_callback(self, done, callback, wants_future):
+        try:
+            callback(done if wants_future else done.result())
+        except Exception as e:
+            self.fail(e)
+        finally:
+            self.release()
+    
+    def fail(self, error):
+        with self.lock:
+            if not self.future.done():
+                self.future.set_exception(error)
+    
+    def release(self):
+        with self.lock:
+            self.outstanding -= 1
+            if self.outstanding > 0 or self.future.done():
+                return
+            try:
+                self.future.set_result(_finish_analysis(self.analysis))
+            except Exception as e:
+                self.future.set_exception(e)
+    
+    def on_decoded(self, image):
+        self.image = image
+        pools = self.pipeline
+        # Forced enhancement always runs, so the original skips the cascade first stage too
+        cascade = not (self.use_enhancement and not self.adaptive)
+        self.chain(pools.classify_pool.submit(lambda: classify_images([image], cascade=cascade)[0]), self.on_original)
+        if self.use_enhancement and not self.adaptive:
+            # Nothing gates enhancement, so it overlaps with the original classification
+            self.chain(pools.enhance_pool.submit(enhance_image, image), self.on_enhanced, wants_future=True)
+    
+    def on_original(self, result):
+        self.analysis["original"] = result
+        if not self.adaptive:
+            return
+        if needs_full_model(result):
+            self.chain(self.pipeline.classify_pool.submit(classify_full, self.image), self.on_original)
+            return
+        quality = gate_quality(self.image, result["confidence"])
+        run_enhancement, reason = enhancement_decision(result["confidence"], quality)
+        self.analysis["enhancement_reason"] = reason
+        self.analysis["image_quality"] = quality
+        if run_enhancement:
+            self.chain(self.pipeline.enhance_pool.submit(enhance_image, self.image), self.on_enhanced, wants_future=True)
+    
+    def on_enhanced(self, done):
+        # Enhancement failures fall back to the original result instead of failing the request
+        try:
+            enhanced_image = done.result()
+        except Exception as e:
+            self.analysis["enhancement_error"] = str(e)
+            self.analysis["enhancement_reason"] = None
+            return
+        self.analysis["enhanced_image"] = enhanced_image
+        self.chain(self.pipeline.classify_pool.submit(lambda: classify_images([enhanced_image], cascade=False)[0]),
+                   self.on_enhanced_classified, wants_future=True)
+    
+    def on_enhanced_classified(self, done):
+        try:
+            self.analysis["enhanced"] = done.result()
+        except Exception as e:
+            self.analysis["enhancement_error"] = str(e)
+            self.analysis["enhancement_reason"] = None
+
+@cache_resource
+def load_analysis_pipeline():
+    config = load_config()
+    return AnalysisPipeline(config["PIPELINE_DECODE_WORKERS"], config["PIPELINE_ENHANCE_WORKERS"],
+                            config["PIPELINE_CLASSIFY_WORKERS"], config["PIPELINE_MAX_IN_FLIGHT"])
@@ -0,0 +1,205 @@
+"""
+INT8 quantization of the YOLO11-cls classifier for CPU serving
+
+Exports the served best.pt (the registry's choice, else YOLO_MODEL_PATH) to
+ONNX, quantizes it to INT8 and writes best.int8.onnx next to the weights,
+where load_yolo_model picks it up when YOLO_BACKEND is "onnxruntime-int8".
+Static quantization is calibrated on a per-class sample of
+PlantVillageY1500/train; --dynamic quantizes weights only.
+
+Every run also checks accuracy parity against the FP32 model on
+PlantVillageY1500/test (top-1/top-5 deltas and per-class confusion changes)
+and exits non-zero when the top-1 drop exceeds --max-top1-drop.
+
+    python quantize.py
+    python quantize.py --dynamic --max-top1-drop 0.5
+"""
+import argparse
+import json
+import logging
+import random
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+import plantcare
+
+
+def preprocess_paths(paths, imgsz):
+    batch = []
+    for path in paths:
+        with Image.open(path) as image:
+            batch.append(plantcare.preprocess_image(image, imgsz))
+    return np.stack(batch)
+
+
+def calibration_sample(train_dir, per_class, seed):
+    """
+    Up to per_class random training images from every class
+    """
+    rng = random.Random(seed)
+    by_class = {}
+    for path, label in plantcare.list_labelled_images(train_dir):
+        by_class.setdefault(label, []).append(path)
+    sample = []
+    for label in sorted(by_class):
+        paths = by_class[label]
+        sample.extend(rng.sample(paths, min(per_class, len(paths))))
+    return sample
+
+
+class ImageCalibrationReader:
+    """
+    Feeds preprocessed calibration batches to onnxruntime's static quantizer
+    """
+    def __init__(self, paths, input_name, imgsz, batch_size):
+        self.batches = iter([paths[i:i + batch_size] for i in range(0, len(paths), batch_size)])
+        self.input_name = input_name
+        self.imgsz = imgsz
+
+    def get_next(self):
+        paths = next(self.batches, None)
+        if paths is None:
+            return None
+        return {self.input_name: preprocess_paths(paths, self.imgsz)}
+
+
+def quantize(fp32_path, int8_path, dynamic, calibration_paths, imgsz, batch_size):
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_dynamic, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    # Shape inference and graph cleanup make more nodes quantizable
+    prepared_path = fp32_path.with_suffix(".prep.onnx")
+    quant_pre_process(str(fp32_path), str(prepared_path))
+    try:
+        if dynamic:
+            quantize_dynamic(str(prepared_path), str(int8_path), weight_type=QuantType.QInt8)
+        else:
+            input_name = plantcare.OnnxClassifier(prepared_path).input_name
+            reader = ImageCalibrationReader(calibration_paths, input_name, imgsz, batch_size)
+            quantize_static(str(prepared_path), str(int8_path), reader,
+                            quant_format=QuantFormat.QDQ, per_channel=True,
+                            activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+    finally:
+        prepared_path.unlink(missing_ok=True)
+
+
+def predict_split(classifier, items, imgsz, batch_size):
+    probs = []
+    for start in range(0, len(items), batch_size):
+        paths = [path for path, _ in items[start:start + batch_size]]
+        probs.append(classifier.predict(preprocess_paths(paths, imgsz)))
+    return np.concatenate(probs)
+
+
+def accuracy(probs, labels):
+    top5 = np.argsort(probs, axis=1)[:, ::-1][:, :5]
+    return {
+        "top1": float((top5[:, 0] == labels).mean()),
+        "top5": float((top5 == labels[:, None]).any(axis=1).mean()),
+    }
+
+
+def confusion_matrix(predicted, labels):
+    n = len(plantcare.CLASS_NAMES)
+    return np.bincount(labels * n + predicted, minlength=n * n).reshape(n, n)
+
+
+def parity_report(fp32_probs, int8_probs, labels):
+    fp32_pred, int8_pred = fp32_probs.argmax(axis=1), int8_probs.argmax(axis=1)
+    fp32_acc, int8_acc = accuracy(fp32_probs, labels), accuracy(int8_probs, labels)
+    fp32_cm, int8_cm = confusion_matrix(fp32_pred, labels), confusion_matrix(int8_pred, labels)
+
+    per_class = {}
+    for idx, name in enumerate(plantcare.CLASS_NAMES):
+        changes = {plantcare.CLASS_NAMES[j]: int(int8_cm[idx, j] - fp32_cm[idx, j])
+                   for j in range(len(plantcare.CLASS_NAMES)) if int8_cm[idx, j] != fp32_cm[idx, j]}
+        support = int(fp32_cm[idx].sum())
+        per_class[name] = {
+            "support": support,
+            "fp32_recall": float(fp32_cm[idx, idx] / support) if support else None,
+            "int8_recall": float(int8_cm[idx, idx] / support) if support else None,
+            "prediction_changes": changes,
+        }
+
+    return {
+        "images": int(len(labels)),
+        "fp32": fp32_acc,
+        "int8": int8_acc,
+        "top1_delta": int8_acc["top1"] - fp32_acc["top1"],
+        "top5_delta": int8_acc["top5"] - fp32_acc["top5"],
+        "prediction_agreement": float((fp32_pred == int8_pred).mean()),
+        "max_prob_abs_diff": float(np.abs(fp32_probs - int8_probs).max()),
+        "per_class": per_class,
+        "fp32_confusion": fp32_cm.tolist(),
+        "int8_confusion": int8_cm.tolist(),
+    }
+
+
+def main():
+    config = plantcare.load_config()
+    dataset = Path(config["DATASET_PATH"])
+    parser = argparse.ArgumentParser(description="Quantize the YOLO classifier to INT8 and check accuracy parity")
+    parser.add_argument("--weights", default=plantcare.resolve_model_path())
+    parser.add_argument("--train-dir", default=str(dataset / "train"))
+    parser.add_argument("--test-dir", default=str(dataset / "test"))
+    parser.add_argument("--dynamic", action="store_true", help="weight-only dynamic quantization, no calibration")
+    parser.add_argument("--calibration-per-class", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-top1-drop", type=float, default=1.0, help="accuracy budget in percentage points")
+    parser.add_argument("--report", help="defaults to <weights>.int8.report.json")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    imgsz = config["YOLO_IMGSZ"]
+    weights = Path(args.weights)
+    weights_sha256 = plantcare.file_sha256(weights)
+    int8_path = weights.with_suffix(".int8.onnx")
+    report_path = Path(args.report) if args.report else weights.with_suffix(".int8.report.json")
+
+    fp32_path = plantcare.export_onnx(weights, imgsz)
+    calibration = [] if args.dynamic else calibration_sample(args.train_dir, args.calibration_per_class, args.seed)
+    logging.info("Quantizing %s (%s, %d calibration images)", fp32_path,
+                 "dynamic" if args.dynamic else "static", len(calibration))
+    quantize(fp32_path, int8_path, args.dynamic, calibration, imgsz, args.batch_size)
+    # load_classifier refuses an INT8 model whose source hash does not match the served weights
+    plantcare.write_artifact_source(int8_path, weights_sha256)
+
+    test_items = plantcare.list_labelled_images(args.test_dir)
+    labels = np.array([label for _, label in test_items])
+    fp32_probs = predict_split(plantcare.OnnxClassifier(fp32_path), test_items, imgsz, args.batch_size)
+    int8_probs = predict_split(plantcare.OnnxClassifier(int8_path), test_items, imgsz, args.batch_size)
+
+    report = parity_report(fp32_probs, int8_probs, labels)
+    report.update({
+        "weights": str(weights),
+        "weights_sha256": weights_sha256,
+        "int8_model": str(int8_path),
+        "mode": "dynamic" if args.dynamic else "static",
+        "calibration_images": len(calibration),
+        "fp32_size_mb": fp32_path.stat().st_size / 1e6,
+        "int8_size_mb": int8_path.stat().st_size / 1e6,
+        "max_top1_drop": args.max_top1_drop,
+    })
+    report["within_budget"] = -report["top1_delta"] * 100 <= args.max_top1_drop
+    report_path.write_text(json.dumps(report, indent=2))
+
+    print(f"FP32 top-1 {report['fp32']['top1']*100:.2f}%  top-5 {report['fp32']['top5']*100:.2f}%")
+    print(f"INT8 top-1 {report['int8']['top1']*100:.2f}%  top-5 {report['int8']['top5']*100:.2f}%")
+    print(f"Delta top-1 {report['top1_delta']*100:+.2f} pp  top-5 {report['top5_delta']*100:+.2f} pp, "
+          f"agreement {report['prediction_agreement']*100:.2f}%")
+    for name, info in report["per_class"].items():
+        if info["prediction_changes"]:
+            print(f"  {name}: {info['prediction_changes']}")
+    print(f"Report written to {report_path}")
+
+    if not report["within_budget"]:
+        print(f"✗ Top-1 drop exceeds the {args.max_top1_drop} pp budget; do not deploy {int8_path}")
+        raise SystemExit(1)
+    print(f"✓ Within budget. Set YOLO_BACKEND = \"onnxruntime-int8\" to serve {int8_path}")
+
+
+if __name__ == "__main__":
+    main()
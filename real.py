@@ -1,16 +1,9 @@
 import streamlit as st
-import torch
 from PIL import Image
 from pathlib import Path
-import numpy as np
-import warnings
-import sys
-import logging
-from ultralytics import YOLO
-import tempfile
-import os
-import subprocess
-import shutil
+
+from plantcare import (DISEASE_CURE, analyze_plant, decode_image, load_config, load_metrics,
+                       load_model_manager, start_metrics_server, start_model_warmup)
 
 # ==============================
 # PAGE CONFIGURATION
@@ -832,318 +825,6 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# ==============================
-# CONFIGURATION
-# ==============================
-@st.cache_resource
-def load_config():
-    config = {
-        "REALESRGAN_PATH": r"C:\Users\vkr30\Real-ESRGAN",
-        "MODEL_REALESRGAN_PATH": r"C:\Users\vkr30\Real-ESRGAN\weights\RealESRGAN_x4plus.pth",
-        "YOLO_MODEL_PATH": r"C:\Users\vkr30\Image Segmentation_Plant Disease\Yolov11 Variants for PDP\best.pt",
-        "HEALTHY_IMAGES_PATH": r"C:\Users\vkr30\Image Segmentation_Plant Disease\healthy"
-    }
-    return config
-
-# ==============================
-# DISEASE CURES
-# ==============================
-DISEASE_CURE = {
-    "Pepper__bell___Bacterial_spot": [
-        "Remove and destroy infected leaves.",
-        "Spray copper-based bactericides regularly.",
-        "Practice crop rotation and sanitize tools to prevent spread.",
-        "Ensure good air circulation by pruning dense foliage."
-    ],
-    "Potato___Early_blight": [
-        "Remove affected foliage to prevent spore spread.",
-        "Apply fungicides containing Chlorothalonil or Mancozeb.",
-        "Rotate crops and avoid planting potatoes in the same soil consecutively.",
-        "Ensure proper spacing for good air circulation."
-    ],
-    "Potato___Late_blight": [
-        "Remove and destroy infected plants immediately.",
-        "Apply fungicides containing Metalaxyl or Mancozeb at the first signs of infection.",
-        "Avoid overhead irrigation; use drip irrigation instead.",
-        "Plant resistant potato varieties if available."
-    ],
-    "Tomato_Bacterial_spot": [
-        "Remove and destroy infected leaves.",
-        "Spray copper-based bactericides regularly.",
-        "Practice crop rotation and sanitize tools to prevent spread.",
-        "Ensure good air circulation by pruning dense foliage."
-    ],
-    "Tomato_Early_blight": [
-        "Remove affected leaves and destroy them.",
-        "Apply fungicides such as Chlorothalonil or Copper hydroxide.",
-        "Rotate crops and avoid planting tomatoes in the same soil consecutively.",
-        "Keep soil moisture consistent but avoid wetting leaves."
-    ],
-    "Tomato_Late_blight": [
-        "Remove infected plants and dispose of them safely.",
-        "Apply protective fungicides like Metalaxyl or Mancozeb before infection spreads.",
-        "Ensure good drainage to prevent waterlogging.",
-        "Plant resistant tomato varieties if possible."
-    ],
-    "Tomato_Leaf_Mold": [
-        "Remove infected leaves to prevent spore spread.",
-        "Apply fungicides such as Mancozeb or Copper oxychloride.",
-        "Maintain proper plant spacing for airflow.",
-        "Avoid wetting leaves during irrigation."
-    ],
-    "Tomato_Septoria_leaf_spot": [
-        "Remove infected leaves and destroy them.",
-        "Apply fungicides like Chlorothalonil or Mancozeb.",
-        "Practice crop rotation and keep soil clean from debris.",
-        "Ensure proper spacing and airflow around plants."
-    ],
-    "Tomato_Spider_mites_Two_spotted_spider_mite": [
-        "Spray insecticidal soap or neem oil directly on affected areas.",
-        "Maintain adequate humidity to discourage mite development.",
-        "Introduce natural predators like ladybugs or predatory mites.",
-        "Avoid excessive use of nitrogen fertilizers which favor mite growth."
-    ],
-    "Tomato__Target_Spot": [
-        "Remove and destroy infected leaves.",
-        "Apply fungicides like Chlorothalonil or Copper oxychloride.",
-        "Ensure good spacing and pruning for airflow.",
-        "Practice crop rotation to reduce recurring infections."
-    ],
-    "Tomato__Tomato_YellowLeaf__Curl_Virus": [
-        "Remove and destroy infected plants immediately.",
-        "Control whitefly populations using yellow sticky traps or insecticides.",
-        "Avoid planting tomatoes near infected crops.",
-        "Use resistant tomato varieties if available."
-    ],
-    "Tomato__Tomato_mosaic_virus": [
-        "Remove infected plants and sanitize all tools.",
-        "Avoid handling healthy plants after touching infected ones.",
-        "Practice crop rotation and avoid planting tomatoes continuously.",
-        "Wash hands and tools frequently to prevent virus spread."
-    ]
-}
-
-# ==============================
-# SUPPRESS WARNINGS
-# ==============================
-warnings.filterwarnings('ignore')
-logging.getLogger("ultralytics").setLevel(logging.ERROR)
-
-# ==============================
-# LOAD MODELS
-# ==============================
-@st.cache_resource
-def load_yolo_model():
-    config = load_config()
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-    model = YOLO(config["YOLO_MODEL_PATH"])
-    return model, device
-
-# ==============================
-# IMAGE ENHANCEMENT WITH REAL-ESRGAN
-# ==============================
-def enhance_image_with_realesrgan(image):
-    """
-    Enhance image using Real-ESRGAN via subprocess call
-    Uses Real-ESRGAN's own inputs/results folders
-    """
-    config = load_config()
-    
-    # Use Real-ESRGAN's own folders
-    input_folder = os.path.join(config["REALESRGAN_PATH"], "inputs")
-    output_folder = os.path.join(config["REALESRGAN_PATH"], "results")
-    
-    # Create folders if they don't exist
-    os.makedirs(input_folder, exist_ok=True)
-    os.makedirs(output_folder, exist_ok=True)
-    
-    # Generate unique filename to avoid conflicts
-    import uuid
-    unique_id = str(uuid.uuid4())[:8]
-    input_filename = f"plantcare_{unique_id}.png"
-    input_path = os.path.join(input_folder, input_filename)
-    
-    # Expected output filename (Real-ESRGAN adds _out suffix)
-    output_filename = f"plantcare_{unique_id}_out.png"
-    output_path = os.path.join(output_folder, output_filename)
-    
-    try:
-        # Save input image
-        image.save(input_path, "PNG")
-        
-        print(f"✓ Saved input image to: {input_path}")
-        print(f"✓ Input image exists: {os.path.exists(input_path)}")
-        print(f"✓ Expected output: {output_path}")
-        
-        # Verify Real-ESRGAN installation
-        inference_script = os.path.join(config["REALESRGAN_PATH"], "inference_realesrgan.py")
-        if not os.path.exists(inference_script):
-            raise Exception(f"Real-ESRGAN inference script not found at: {inference_script}")
-        
-        model_path = config["MODEL_REALESRGAN_PATH"]
-        if not os.path.exists(model_path):
-            raise Exception(f"Model weights not found at: {model_path}")
-        
-        print(f"✓ Inference script: {inference_script}")
-        print(f"✓ Model weights: {model_path}")
-        
-        # Build Real-ESRGAN command - process single file
-        command = [
-            "python", 
-            inference_script,
-            "-n", "RealESRGAN_x4plus",
-            "-i", input_path,
-            "-o", output_folder,
-            "-s", "4",
-            "--fp32",
-            "--ext", "png"  # Force PNG output
-        ]
-        
-        # Print command for debugging
-        print("\n" + "="*50)
-        print("Running Real-ESRGAN command:")
-        print(" ".join(command))
-        print("="*50 + "\n")
-        
-        # Run Real-ESRGAN enhancement from its directory
-        result = subprocess.run(
-            command, 
-            capture_output=True, 
-            text=True,
-            timeout=180,
-            cwd=config["REALESRGAN_PATH"]
-        )
-        
-        # Print output for debugging
-        print("\n--- Real-ESRGAN Output ---")
-        print("Return code:", result.returncode)
-        if result.stdout:
-            print("\nSTDOUT:")
-            print(result.stdout)
-        if result.stderr:
-            print("\nSTDERR:")
-            print(result.stderr)
-        print("--- End Output ---\n")
-        
-        # Wait for file system to sync
-        import time
-        time.sleep(2)  # Increased wait time
-        
-        # List all files in both input and output folders
-        print(f"\nInput folder contents: {os.listdir(input_folder)}")
-        print(f"Output folder contents: {os.listdir(output_folder)}")
-        
-        # Check if output was created
-        if not os.path.exists(output_path):
-            # List all files in output folder for debugging
-            output_files = os.listdir(output_folder) if os.path.exists(output_folder) else []
-            print(f"⚠ Expected output not found: {output_path}")
-            print(f"Files in output folder: {output_files}")
-            
-            # Try to find any output with similar name
-            possible_outputs = [
-                f"plantcare_{unique_id}_out.jpg",
-                f"plantcare_{unique_id}.png",
-                f"plantcare_{unique_id}.jpg"
-            ]
-            
-            for possible in possible_outputs:
-                test_path = os.path.join(output_folder, possible)
-                if os.path.exists(test_path):
-                    output_path = test_path
-                    print(f"✓ Found alternative output: {possible}")
-                    break
-            
-            # If still not found, check for any new files
-            if not os.path.exists(output_path):
-                # Get the newest file in output folder
-                if output_files:
-                    newest_file = max([os.path.join(output_folder, f) for f in output_files], 
-                                    key=os.path.getctime)
-                    if newest_file.lower().endswith(('.png', '.jpg', '.jpeg')):
-                        output_path = newest_file
-                        print(f"✓ Using newest file: {os.path.basename(newest_file)}")
-        
-        # Final check
-        if not os.path.exists(output_path):
-            error_msg = f"""
-Real-ESRGAN did not produce output image.
-
-Paths:
-- Input: {input_path} (exists: {os.path.exists(input_path)})
-- Expected output: {output_path}
-- Output folder: {output_folder}
-
-Files in output folder: {os.listdir(output_folder) if os.path.exists(output_folder) else 'folder does not exist'}
-
-Real-ESRGAN output:
-{result.stdout}
-{result.stderr}
-
-Suggestion: Try running this command manually in terminal:
-cd {config["REALESRGAN_PATH"]}
-python inference_realesrgan.py -n RealESRGAN_x4plus -i {input_path} -o {output_folder} -s 4 --fp32
-            """
-            raise Exception(error_msg)
-        
-        print(f"✓ Loading enhanced image from: {output_path}")
-        enhanced_image = Image.open(output_path).convert('RGB')
-        print(f"✓ Enhanced image size: {enhanced_image.size}")
-        
-        return enhanced_image
-        
-    except subprocess.TimeoutExpired:
-        raise Exception("Real-ESRGAN timed out (>180s). Try with a smaller image.")
-    except Exception as e:
-        import traceback
-        error_detail = traceback.format_exc()
-        print("\n!!! ERROR !!!")
-        print(error_detail)
-        print("!!! END !!!\n")
-        raise
-    finally:
-        # Don't cleanup - leave files for debugging
-        # User can manually clean the folders if needed
-        print(f"\n📁 Files kept for inspection:")
-        print(f"   Input: {input_path}")
-        print(f"   Expected output: {output_path}")
-        print(f"\nTo clean up manually, delete files from:")
-        print(f"   {input_folder}")
-        print(f"   {output_folder}")
-
-
-# ==============================
-# DISEASE DETECTION
-# ==============================
-def detect_disease(image):
-    model, device = load_yolo_model()
-    
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp:
-        image.save(tmp.name)
-        tmp_path = tmp.name
-    
-    results = model(tmp_path)
-    pred = results[0]
-    
-    class_names = [
-        "Pepper__bell___Bacterial_spot","Pepper__bell___healthy",
-        "Potato___Early_blight","Potato___Late_blight","Potato___healthy",
-        "Tomato_Bacterial_spot","Tomato_Early_blight","Tomato_Late_blight",
-        "Tomato_Leaf_Mold","Tomato_Septoria_leaf_spot",
-        "Tomato_Spider_mites_Two_spotted_spider_mite","Tomato__Target_Spot",
-        "Tomato__Tomato_YellowLeaf__Curl_Virus","Tomato__Tomato_mosaic_virus",
-        "Tomato_healthy"
-    ]
-    pred.names = {i:name for i,name in enumerate(class_names)}
-    
-    class_idx = int(pred.probs.top1)
-    cls_name = pred.names[class_idx]
-    conf = pred.probs.data[class_idx].item()
-    
-    os.unlink(tmp_path)
-    
-    return cls_name, conf
-
 # ==============================
 # HEALTHY IMAGE PICKER
 # ==============================
@@ -1161,6 +842,10 @@ def get_healthy_image_for_class(predicted_class):
 # MAIN APP
 # ==============================
 def main():
+    # Load the model in the background while the page renders
+    warmup = start_model_warmup()
+    start_metrics_server()
+    
     # Initialize session state
     if 'analyzed' not in st.session_state:
         st.session_state.analyzed = False
@@ -1373,7 +1058,12 @@ def main():
     st.markdown("</div>", unsafe_allow_html=True)
     
     if uploaded_file is not None:
-        input_image = Image.open(uploaded_file).convert('RGB')
+        # Decode once per upload; reruns from widgets reuse the image, so the
+        # decode span and input size metrics count uploads, not reruns
+        if st.session_state.get('decoded_file_id') != uploaded_file.file_id:
+            st.session_state.decoded_image = decode_image(uploaded_file)
+            st.session_state.decoded_file_id = uploaded_file.file_id
+        input_image = st.session_state.decoded_image
         
         st.markdown("<br>", unsafe_allow_html=True)
         
@@ -1388,51 +1078,33 @@ def main():
         col1, col2, col3 = st.columns([2, 1, 2])
         with col2:
             if st.button("🔬 Analyze Plant", type="primary", width='stretch'):
-                with st.spinner("🔄 Analyzing image..."):
-                    # Detect on original
-                    original_class, original_conf = detect_disease(input_image)
+                if not warmup.ready.is_set():
+                    with st.spinner("⏳ Loading the AI model..."):
+                        warmup.wait()
+                spinner_text = "✨ Analyzing and enhancing image with Real-ESRGAN..." if use_enhancement else "🔄 Analyzing image..."
+                with st.spinner(spinner_text):
+                    analysis = analyze_plant(input_image, use_enhancement)
+                    
+                    if analysis["enhancement_error"] is not None:
+                        st.warning(f"⚠️ Enhancement failed: {analysis['enhancement_error']}. Using original image.")
                     
-                    # Enhancement if enabled
-                    if use_enhancement:
-                        try:
-                            with st.spinner("✨ Enhancing image with Real-ESRGAN (4x upscaling)..."):
-                                enhanced_image = enhance_image_with_realesrgan(input_image)
-                                st.success("✅ Image enhanced successfully with Real-ESRGAN!")
-                                
-                            with st.spinner("🔍 Detecting disease on enhanced image..."):
-                                enhanced_class, enhanced_conf = detect_disease(enhanced_image)
-                            
-                            # Compare results and use the one with higher confidence
-                            if enhanced_conf > original_conf:
-                                final_class = enhanced_class
-                                final_conf = enhanced_conf
-                                used_which = "enhanced"
-                            else:
-                                final_class = original_class
-                                final_conf = original_conf
-                                used_which = "original"
-                            
-                            # Store enhanced image and flag in session state
-                            st.session_state.enhanced_image = enhanced_image
-                            st.session_state.used_enhancement = True
-                            st.session_state.used_which = used_which
-                            st.session_state.original_conf = original_conf
-                            st.session_state.enhanced_conf = enhanced_conf
-                            
-                        except Exception as e:
-                            st.warning(f"⚠️ Enhancement failed: {str(e)}. Using original image.")
-                            final_class = original_class
-                            final_conf = original_conf
-                            st.session_state.used_enhancement = False
-                    else:
-                        final_class = original_class
-                        final_conf = original_conf
-                        st.session_state.used_enhancement = False
+                    final_class = analysis["final_class"]
+                    final_conf = analysis["final_conf"]
+                    st.session_state.enhancement_reason = analysis["enhancement_reason"]
+                    st.session_state.image_quality = analysis["image_quality"]
+                    st.session_state.used_enhancement = analysis["used_enhancement"]
+                    if analysis["used_enhancement"]:
+                        # Store enhanced image and flag in session state
+                        st.session_state.enhanced_image = analysis["enhanced_image"]
+                        st.session_state.used_which = analysis["used_which"]
+                        st.session_state.original_conf = analysis["original"]["confidence"]
+                        st.session_state.enhanced_conf = analysis["enhanced"]["confidence"]
                     
                     # Store in session state
                     st.session_state.analyzed = True
                     st.session_state.final_class = final_class
                     st.session_state.final_conf = final_conf
+                    st.session_state.model_version = analysis["model_version"]
                     st.session_state.input_image = input_image
                     st.rerun()
     
@@ -1440,6 +1112,11 @@ def main():
     if st.session_state.analyzed:
         st.markdown("<br><br>", unsafe_allow_html=True)
         
+        # Explain why the adaptive gate skipped enhancement
+        if not st.session_state.used_enhancement and st.session_state.get("enhancement_reason"):
+            st.info(f"ℹ️ Enhancement skipped: {st.session_state.enhancement_reason}")
+            st.markdown("<br>", unsafe_allow_html=True)
+        
         # Show enhancement comparison only if enhancement was used AND it improved the result
         if st.session_state.used_enhancement and st.session_state.enhanced_image is not None:
             # Only show comparison if enhanced result was better or equal
@@ -1568,6 +1245,8 @@ def main():
             
             st.success("🎉 Great news! Your plant appears to be healthy. Continue with regular care and monitoring.")
         
+        st.caption(f"Model version: {st.session_state.get('model_version')}")
+        
         # Reset Button
         st.markdown("<br>", unsafe_allow_html=True)
         col1, col2, col3 = st.columns([2, 1, 2])
@@ -1578,6 +1257,27 @@ def main():
                 st.session_state.used_enhancement = False
                 st.rerun()
     
+    # Per-stage latency and counters for capacity planning
+    if load_config()["METRICS_DEBUG_PANEL"]:
+        metrics = load_metrics()
+        with st.expander("🛠️ Debug: pipeline metrics"):
+            stages = metrics.stage_summary()
+            if stages:
+                st.table([{"stage": stage, "count": stats["count"], "mean ms": f"{stats['mean_ms']:.1f}",
+                           "p50 ms ≤": f"{stats['p50_ms']:.0f}", "p95 ms ≤": f"{stats['p95_ms']:.0f}"}
+                          for stage, stats in stages.items()])
+            st.json(metrics.counter_values())
+            
+            # Loading the manager here would block the page until warm-up finishes
+            if warmup.ready.is_set() and warmup.error is None:
+                manager = load_model_manager()
+                st.caption(f"Serving {manager.status()['version']}")
+                if st.button("🔄 Reload model weights"):
+                    try:
+                        st.success(f"Now serving {manager.reload().result()}")
+                    except Exception as e:
+                        st.error(f"Reload failed, still serving the previous model: {e}")
+    
     # Footer
     st.markdown("""
         <div class="footer-container">
@@ -0,0 +1,180 @@
+"""
+Headless HTTP inference service for PlantCare AI
+
+Reuses the model loading, detection and enhancement code in plantcare.py
+without rendering the Streamlit UI. The YOLO model is loaded and warmed up
+once per worker on a background thread and shared by all request threads.
+
+    python server.py --host 0.0.0.0 --port 8000
+
+Endpoints (request body is the raw image bytes):
+    POST /classify              -> class, confidence, top5, cure steps
+    POST /enhance-and-classify  -> same, after the Real-ESRGAN enhancement path
+    GET  /health                -> process is up
+    GET  /ready                 -> 200 once the model is loaded and warmed up, 503 before
+    GET  /stats                 -> cache counters, scheduler queue depth and batch sizes,
+                                   cascade escalation rates
+    GET  /metrics               -> stage latencies, counters and histograms in Prometheus format
+    GET  /model                 -> served model version, reload count and draining versions
+    POST /admin/reload          -> hot-reload the classifier (localhost only); optional
+                                   JSON body {"weights": "path/to/best.pt"}
+"""
+import argparse
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import plantcare
+
+MAX_UPLOAD_BYTES = 25 * 1024 * 1024
+
+
+def build_response(analysis):
+    final_class = analysis["final_class"]
+    final = analysis["enhanced"] if analysis["used_which"] == "enhanced" else analysis["original"]
+    response = {
+        "class": final_class,
+        "confidence": analysis["final_conf"],
+        "healthy": final_class.lower().endswith("healthy"),
+        "top5": [{"class": name, "confidence": conf} for name, conf in final["top5"]],
+        "cure": plantcare.DISEASE_CURE.get(final_class, []),
+        "model_version": analysis["model_version"],
+    }
+    if analysis["enhanced"] is not None or analysis["enhancement_reason"] or analysis["enhancement_error"]:
+        response["enhancement"] = {
+            "used": analysis["used_enhancement"],
+            "used_which": analysis["used_which"],
+            "original_confidence": analysis["original"]["confidence"],
+            "enhanced_confidence": analysis["enhanced"]["confidence"] if analysis["enhanced"] else None,
+            "reason": analysis["enhancement_reason"],
+            "error": analysis["enhancement_error"],
+        }
+    return response
+
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        if length <= 0:
+            self._send_json(400, {"error": "Request body must contain the image bytes"})
+            return None
+        if length > MAX_UPLOAD_BYTES:
+            self._send_json(413, {"error": f"Image larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB"})
+            return None
+        return self.rfile.read(length)
+    
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif self.path == "/ready":
+            # Load balancers should only route traffic here once warm-up is done
+            status = plantcare.start_model_warmup().status()
+            self._send_json(200 if status["ready"] else 503, status)
+        elif self.path == "/stats":
+            stats = {"cache": None, "scheduler": None, "cascade": None}
+            cache = plantcare.load_result_cache()
+            if cache is not None:
+                stats["cache"] = cache.stats()
+            if plantcare.load_config()["MICRO_BATCHING"]:
+                stats["scheduler"] = plantcare.load_batch_scheduler().stats()
+            if plantcare.load_config()["CASCADE_ENABLED"]:
+                stats["cascade"] = plantcare.cascade_stats()
+            self._send_json(200, stats)
+        elif self.path == "/model":
+            self._send_json(200, plantcare.load_model_manager().status())
+        elif self.path == "/metrics":
+            body = plantcare.load_metrics().render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json(404, {"error": "Not found"})
+    
+    def _reload_model(self):
+        if self.client_address[0] not in ("127.0.0.1", "::1"):
+            self._send_json(403, {"error": "Model reload is only allowed from localhost"})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            options = json.loads(self.rfile.read(length)) if length > 0 else {}
+        except ValueError:
+            self._send_json(400, {"error": "Body must be JSON"})
+            return
+        weights = options.get("weights")
+        # The localhost check does not hold behind a same-host reverse proxy, so never load arbitrary paths
+        if weights is not None and not plantcare.is_servable_weights(weights):
+            self._send_json(403, {"error": "weights must be a registered checkpoint or a file under MODEL_RUNS_PATH"})
+            return
+        try:
+            plantcare.start_model_warmup().wait()
+            # Requests keep being served by the old model until the swap
+            version = plantcare.load_model_manager().reload(weights).result()
+        except Exception as e:
+            self._send_json(500, {"error": f"Reload failed, still serving the previous model: {e}"})
+            return
+        self._send_json(200, {"model_version": version})
+    
+    def do_POST(self):
+        if self.path == "/admin/reload":
+            self._reload_model()
+            return
+        routes = {"/classify": False, "/enhance-and-classify": True}
+        if self.path not in routes:
+            self._send_json(404, {"error": "Not found"})
+            return
+        data = self._read_body()
+        if data is None:
+            return
+        try:
+            plantcare.start_model_warmup().wait()
+            # Raw bytes go to the pipeline, which decodes them on its own worker pool
+            analysis = plantcare.analyze_plant(data, use_enhancement=routes[self.path])
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            logging.exception("Inference failed")
+            self._send_json(500, {"error": str(e)})
+            return
+        self._send_json(200, build_response(analysis))
+    
+    def log_message(self, format, *args):
+        logging.info("%s - %s", self.address_string(), format % args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PlantCare AI HTTP inference service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    
+    # Load and warm the model once for this worker in the background;
+    # /ready turns 200 when it can take traffic
+    plantcare.start_model_warmup()
+    
+    server = ThreadingHTTPServer((args.host, args.port), InferenceHandler)
+    logging.info("PlantCare AI service listening on http://%s:%d", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
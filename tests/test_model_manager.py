@@ -0,0 +1,74 @@
+import os
+import sys
+import tempfile
+import unittest
+from concurrent.futures import Future
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import plantcare
+
+
+class FakeVersion:
+    def __init__(self, weights):
+        self.weights = str(Path(weights))
+        self.stamp = plantcare._file_stamp(weights)
+        self.name = Path(weights).name
+
+
+def write_catalog(path, entries):
+    plantcare.save_model_catalog(path, {"models": entries})
+    # Make the rewrite visible even on filesystems with coarse mtimes
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def entry(run, weights, top1):
+    return {"run": run, "weights": str(weights), "imgsz": 224, "best_top1": top1, "cpu_latency_ms": 5.0}
+
+
+class ModelWatchTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        root = Path(self.tmp.name)
+        self.old_weights, self.new_weights = root / "a.pt", root / "b.pt"
+        self.old_weights.write_bytes(b"a")
+        self.new_weights.write_bytes(b"b")
+        self.catalog = root / "model_registry.json"
+        write_catalog(self.catalog, [entry("a", self.old_weights, 0.90), entry("b", self.new_weights, 0.80)])
+
+        config = plantcare.load_config()
+        patcher = mock.patch.dict(config, {"MODEL_REGISTRY_PATH": str(self.catalog), "MODEL_SELECTION_METRIC": "best_top1",
+                                           "MODEL_MAX_LATENCY_MS": None, "MODEL_PIN_RUN": None, "YOLO_IMGSZ": 224})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmp.cleanup)
+
+        # A manager serving run a, without loading a model or starting the watcher thread
+        self.manager = object.__new__(plantcare.ModelManager)
+        self.manager.current = FakeVersion(self.old_weights)
+        self.manager.target = self.manager.current.weights
+        self.manager.catalog_stamp = plantcare._file_stamp(self.catalog)
+        self.manager.pending, self.manager.failed = None, None
+        done = Future()
+        done.set_result("b")
+        self.manager.reload = mock.Mock(return_value=done)
+
+    def test_unchanged_catalog_does_not_reload(self):
+        for _ in range(3):
+            self.manager._poll()
+        self.manager.reload.assert_not_called()
+
+    def test_rebuilt_catalog_reloads_the_new_choice(self):
+        write_catalog(self.catalog, [entry("a", self.old_weights, 0.90), entry("b", self.new_weights, 0.95)])
+        self.manager._poll()
+        # The first poll only sees the change; the swap waits for one stable poll
+        self.manager.reload.assert_not_called()
+        self.manager._poll()
+        self.manager.reload.assert_called_once_with(str(self.new_weights))
+
+
+if __name__ == "__main__":
+    unittest.main()